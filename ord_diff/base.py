@@ -2,18 +2,48 @@ from __future__ import annotations
 
 from enum import Enum
 
-from ord_schema import reaction_pb2
-
-WORKUP_TYPES = list(reaction_pb2.ReactionWorkup.ReactionWorkupType.keys())
+ORDERED_REPEATED_FIELDS = frozenset({"workups", })
+""" (json) names of repeated fields in which the order of items matters, other repeated fields are sets """
 
 
 class MessageType(str, Enum):
     REACTION_WORKUP = "REACTION_WORKUP"
     COMPOUND = "COMPOUND"
     REACTION_CONDITIONS = "REACTION_CONDITIONS"
+    REACTION_OUTCOME = "REACTION_OUTCOME"
     REACTION = "REACTION"
 
 
+class DiffBackend(str, Enum):
+    """ the engine used to compare two message dictionaries """
+
+    # `deepdiff.DeepDiff` with `ignore_order=True`
+    DEEPDIFF = "DEEPDIFF"
+
+    # `ord_diff.native.NativeDiffer`, aware of ordered repeated fields
+    NATIVE = "NATIVE"
+
+
+class MatchingStrategy(str, Enum):
+    """ how messages of two lists are matched """
+
+    # minimum cost assignment, the order of the lists is ignored
+    ASSIGNMENT = "ASSIGNMENT"
+
+    # order-preserving alignment with gaps, for repeated fields whose order matters, e.g. `Reaction.workups`
+    ALIGNMENT = "ALIGNMENT"
+
+
+class IdentityKernel(str, Enum):
+    """ how identity keys (e.g. compound names) are compared when matching messages """
+
+    # 0 if the keys are equal, otherwise the deep distance of a value change
+    EXACT = "EXACT"
+
+    # as `EXACT`, but the penalty of two different strings is scaled by their dissimilarity
+    SIMILARITY = "SIMILARITY"
+
+
 class DeltaType(str, Enum):
     """ used to describe a result entry from `deepdiff` """
 
@@ -39,3 +69,13 @@ class CompoundLeafType(str, Enum):
     amount = 'amount'
 
     other = 'other'
+
+
+def __getattr__(name):
+    # `WORKUP_TYPES` is read from the protobuf descriptor on first access, so importing this module stays cheap
+    if name == "WORKUP_TYPES":
+        from ord_schema import reaction_pb2
+        workup_types = list(reaction_pb2.ReactionWorkup.ReactionWorkupType.keys())
+        globals()["WORKUP_TYPES"] = workup_types
+        return workup_types
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
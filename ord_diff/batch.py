@@ -0,0 +1,478 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+import pandas as pd
+from google.protobuf import json_format
+from loguru import logger
+from ord_schema import reaction_pb2
+from pydantic import BaseModel
+
+from ord_diff.base import MessageType, DiffBackend
+from ord_diff.budget import DiffBudget
+from ord_diff.profiling import Profiler, Profile
+from ord_diff.reaction import ReactionDiff
+from ord_diff.report import REACTION_REPORT_COLUMNS, report_reaction_diff
+
+
+class PairError(BaseModel):
+    """ a pair of reactions that failed to be compared """
+
+    rid: str
+    """ reaction id from the pairs file """
+
+    error: str
+    """ the formatted exception """
+
+
+class BatchResult(BaseModel):
+    """ merged result of a batch run """
+
+    report: pd.DataFrame
+    """ concatenated reports of all pairs, in the order of the pairs file, with a `rid` column """
+
+    errors: list[PairError]
+    """ pairs that failed """
+
+    n_pairs: int
+    """ number of pairs submitted """
+
+    elapsed: float
+    """ wall time in seconds """
+
+    profile: Profile | None = None
+    """ stage timings and counters merged across workers, if profiling was requested """
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def throughput(self):
+        """ pairs per second """
+        return self.n_pairs / self.elapsed if self.elapsed else float("inf")
+
+
+def load_pairs(pairs_file: str | os.PathLike) -> list[tuple[str, str, str]]:
+    """ load a pairs file, a json list of [rid, reaction 1 json, reaction 2 json] """
+    with open(pairs_file, "r") as f:
+        data = json.load(f)
+    return [(rid, r1_json, r2_json) for rid, r1_json, r2_json in data]
+
+
+def iter_pairs(pairs_file: str | os.PathLike) -> Iterator[tuple[str, str, str]]:
+    """
+    lazily read a pairs file, in json lines (`.jsonl`, one [rid, reaction 1 json, reaction 2 json] per line)
+    or in json (a list of these, which has to be loaded at once)
+    """
+    if str(pairs_file).endswith(".jsonl"):
+        with open(pairs_file, "r") as f:
+            for line in f:
+                if line.strip():
+                    rid, r1_json, r2_json = json.loads(line)
+                    yield rid, r1_json, r2_json
+    else:
+        yield from load_pairs(pairs_file)
+
+
+def iter_dataset_pairs(
+        dataset_file1: str | os.PathLike, dataset_file2: str | os.PathLike
+) -> Iterator[tuple[str, bytes, bytes]]:
+    """
+    pairs of reactions from two ORD `Dataset` files, paired by `reaction_id` if all reactions have one,
+    otherwise by index, yielded as serialized protobuf bytes
+
+    a `Dataset` is a single protobuf message so both files are parsed and held in memory while pairs are yielded,
+    only the comparisons are streamed, for datasets larger than memory export the pairs to a `.jsonl` pairs file
+    and use `iter_pairs`
+    """
+    from ord_schema.message_helpers import load_message
+    from ord_schema.proto import dataset_pb2
+
+    reactions1 = load_message(str(dataset_file1), dataset_pb2.Dataset).reactions
+    reactions2 = load_message(str(dataset_file2), dataset_pb2.Dataset).reactions
+    if all(r.reaction_id for r in reactions1) and all(r.reaction_id for r in reactions2):
+        rid_to_r2 = {r.reaction_id: r for r in reactions2}
+        for r1 in reactions1:
+            r2 = rid_to_r2.get(r1.reaction_id)
+            if r2 is not None:
+                yield r1.reaction_id, r1.SerializeToString(), r2.SerializeToString()
+    else:
+        for i, (r1, r2) in enumerate(zip(reactions1, reactions2)):
+            yield str(i), r1.SerializeToString(), r2.SerializeToString()
+
+
+def parse_reaction(r: str | bytes) -> reaction_pb2.Reaction:
+    """ a reaction from a json string or serialized protobuf bytes """
+    if isinstance(r, str):
+        return json_format.Parse(r, reaction_pb2.Reaction())
+    return reaction_pb2.Reaction.FromString(r)
+
+
+def diff_reaction_pair(
+        m1: reaction_pb2.Reaction, m2: reaction_pb2.Reaction, backend: DiffBackend = DiffBackend.DEEPDIFF,
+        budget: DiffBudget | None = None,
+) -> pd.DataFrame:
+    """ the report of `ReactionDiff.from_reaction_pair`, see `report_reaction_diff` """
+    return report_reaction_diff(ReactionDiff.from_reaction_pair(m1, m2, backend=backend, budget=budget))
+
+
+def _diff_chunk(
+        chunk: list[tuple[str, str | bytes, str | bytes]], backend: DiffBackend, budget: DiffBudget | None = None,
+        profile: bool = False,
+) -> tuple[list[tuple[str, pd.DataFrame | None, str | None]], Profile | None]:
+    """
+    worker function, one task per chunk to amortize inter-process communication,
+    reactions are parsed here so the parent only reads and ships the raw pairs,
+    the profile of the chunk is returned if requested
+    """
+    results = []
+    with (Profiler() if profile else contextlib.nullcontext()) as profiler:
+        for rid, r1, r2 in chunk:
+            try:
+                m1 = parse_reaction(r1)
+                m2 = parse_reaction(r2)
+                results.append((rid, diff_reaction_pair(m1, m2, backend=backend, budget=budget), None))
+            except Exception:
+                results.append((rid, None, traceback.format_exc()))
+    return results, profiler.profile if profile else None
+
+
+def _merge_profiles(profiles: Iterable[Profile | None]) -> Profile | None:
+    merged = None
+    for p in profiles:
+        if p is not None:
+            merged = Profile().merge(p) if merged is None else merged.merge(p)
+    return merged
+
+
+def _chunks(items: Iterable, chunksize: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def diff_pairs(
+        pairs: list[tuple[str, str | bytes, str | bytes]],
+        n_workers: int | None = None,
+        chunksize: int = 16,
+        backend: DiffBackend = DiffBackend.DEEPDIFF,
+        budget: DiffBudget | None = None,
+        profile: bool = False,
+) -> BatchResult:
+    """
+    compare many pairs of reactions on a process pool
+
+    :param pairs: a list of (rid, reaction 1, reaction 2), reactions are json strings or serialized protobuf bytes
+    :param n_workers: number of processes, default to the number of cpus, 1 means no pool
+    :param chunksize: number of pairs per task
+    :param backend: the diff engine
+    :param budget: limits of each list comparison, see `DiffBudget`
+    :param profile: if stage timings and counters should be collected, see `profiling.Profiler`
+    :return: the merged report, in the order of `pairs`, and errors of failed pairs
+    """
+    ts = time.perf_counter()
+    n_workers = n_workers or os.cpu_count() or 1
+
+    chunks = list(_chunks(pairs, chunksize))
+    if n_workers == 1:
+        chunk_outputs = [_diff_chunk(chunk, backend, budget, profile) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            chunk_outputs = list(executor.map(
+                _diff_chunk, chunks, [backend] * len(chunks), [budget] * len(chunks), [profile] * len(chunks)
+            ))
+    chunk_results = [chunk_result for chunk_result, _ in chunk_outputs]
+
+    dfs = []
+    errors = []
+    for chunk_result in chunk_results:
+        for rid, df, error in chunk_result:
+            if error is not None:
+                errors.append(PairError(rid=rid, error=error))
+                continue
+            df.insert(0, 'rid', rid)
+            dfs.append(df)
+    report = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=["rid"] + REACTION_REPORT_COLUMNS)
+
+    result = BatchResult(
+        report=report, errors=errors, n_pairs=len(pairs), elapsed=time.perf_counter() - ts,
+        profile=_merge_profiles(chunk_profile for _, chunk_profile in chunk_outputs),
+    )
+    logger.info(
+        f"compared {result.n_pairs} pairs in {result.elapsed:.2f} s ({result.throughput:.2f} pairs/s) "
+        f"with {n_workers} workers, {len(errors)} failed"
+    )
+    return result
+
+
+def diff_pairs_file(pairs_file: str | os.PathLike, **kwargs) -> BatchResult:
+    """ `diff_pairs` for a pairs file, see `load_pairs` """
+    return diff_pairs(load_pairs(pairs_file), **kwargs)
+
+
+MANIFEST_FILE = "manifest.jsonl"
+""" checkpoint of a streamed run, one line per part file: {"part": <file name>, "rids": [<rid>, ...]} """
+
+
+class StreamResult(BaseModel):
+    """ summary of a streamed batch run, the reports are in the part files """
+
+    parts: list[str]
+    """ paths to all part files in the output folder, including those of previous runs, in the order written """
+
+    n_pairs: int
+    """ number of pairs compared in this run """
+
+    n_skipped: int
+    """ number of pairs skipped as they were done in a previous run """
+
+    n_errors: int
+    """ number of pairs failed, see `errors.jsonl` in the output folder """
+
+    elapsed: float
+    """ wall time in seconds """
+
+    profile: Profile | None = None
+    """ stage timings and counters of this run merged across workers, if profiling was requested """
+
+    @property
+    def throughput(self):
+        """ pairs per second """
+        return self.n_pairs / self.elapsed if self.elapsed else float("inf")
+
+
+class _PartWriter:
+    """
+    buffer reports and write them to numbered part files once `part_size` rows are collected
+
+    after a part file is written, its rids are appended to `manifest.jsonl`, these pairs are skipped
+    when the run is resumed; a part file not (yet) in the manifest is overwritten by the next run
+    """
+
+    def __init__(self, output_dir: str | os.PathLike, part_size: int, output_format: str):
+        assert output_format in ("csv", "parquet")
+        self.output_dir = output_dir
+        self.part_size = part_size
+        self.output_format = output_format
+        self.manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+        self.parts = []
+        self.done_rids = set()
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, "rb") as f:
+                lines = f.read().splitlines(keepends=True)
+            if lines and not lines[-1].endswith(b"\n"):
+                # a partially written last line from an interrupted run, cut so the next entry starts a new line
+                with open(self.manifest_path, "r+b") as f:
+                    f.truncate(sum(len(line) for line in lines[:-1]))
+                lines = lines[:-1]
+            for line in lines:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.parts.append(os.path.join(output_dir, entry["part"]))
+                self.done_rids.update(entry["rids"])
+        self._buffer = []
+        self._buffer_rids = []
+        self._n_buffered = 0
+
+    def add(self, rid: str, df: pd.DataFrame):
+        self._buffer.append(df)
+        self._buffer_rids.append(rid)
+        self._n_buffered += len(df)
+        if self._n_buffered >= self.part_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer_rids:
+            return
+        df = pd.concat(self._buffer, ignore_index=True)
+        part = f"part-{len(self.parts):05d}.{self.output_format}"
+        path = os.path.join(self.output_dir, part)
+        tmp_path = f"{path}.tmp"
+        if self.output_format == "csv":
+            df.to_csv(tmp_path, index=False)
+        else:
+            df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        with open(self.manifest_path, "a") as f:
+            f.write(json.dumps({"part": part, "rids": self._buffer_rids}) + "\n")
+        self.parts.append(path)
+        self.done_rids.update(self._buffer_rids)
+        self._buffer = []
+        self._buffer_rids = []
+        self._n_buffered = 0
+
+
+def stream_diff_pairs(
+        pairs: Iterable[tuple[str, str | bytes, str | bytes]],
+        output_dir: str | os.PathLike,
+        n_workers: int | None = None,
+        chunksize: int = 16,
+        part_size: int = 100_000,
+        output_format: str = "csv",
+        backend: DiffBackend = DiffBackend.DEEPDIFF,
+        budget: DiffBudget | None = None,
+        profile: bool = False,
+) -> StreamResult:
+    """
+    compare pairs of reactions from an iterator, e.g. `iter_pairs` or `iter_dataset_pairs`,
+    and write reports to `output_dir` as they come
+
+    at most `2 * n_workers` chunks are in flight and at most `part_size` report rows are buffered,
+    so memory does not grow with the number of pairs; part files are written atomically
+    and can be read while the run is in progress
+
+    the run is checkpointed in `manifest.jsonl`, calling this again with the same `output_dir` skips
+    pairs whose reports are already written, pairs that failed or were not written are compared again
+
+    :param pairs: (rid, reaction 1, reaction 2), reactions are json strings or serialized protobuf bytes
+    :param output_dir: the folder for `part-xxxxx.csv` (or `.parquet`) and `errors.jsonl`
+    :param n_workers: number of processes, default to the number of cpus, 1 means no pool
+    :param chunksize: number of pairs per task
+    :param part_size: number of report rows per part file
+    :param output_format: `csv` or `parquet` (requires `pyarrow`)
+    :param backend: the diff engine
+    :param budget: limits of each list comparison, see `DiffBudget`
+    :param profile: if stage timings and counters should be collected, see `profiling.Profiler`
+    """
+    ts = time.perf_counter()
+    n_workers = n_workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    writer = _PartWriter(output_dir, part_size, output_format)
+    n_pairs = 0
+    n_skipped = 0
+    n_errors = 0
+    profiles = []
+
+    def todo():
+        nonlocal n_skipped
+        for pair in pairs:
+            if pair[0] in writer.done_rids:
+                n_skipped += 1
+                continue
+            yield pair
+
+    # failed pairs are always retried, so errors of previous runs are not kept
+    with open(os.path.join(output_dir, "errors.jsonl"), "w") as errors_file:
+
+        def collect(chunk_output):
+            nonlocal n_pairs, n_errors
+            chunk_result, chunk_profile = chunk_output
+            profiles.append(chunk_profile)
+            errors = []
+            for rid, df, error in chunk_result:
+                if error is not None:
+                    errors.append(PairError(rid=rid, error=error))
+                    continue
+                df.insert(0, 'rid', rid)
+                writer.add(rid, df)
+            for e in errors:
+                errors_file.write(e.model_dump_json() + "\n")
+            errors_file.flush()
+            n_pairs += len(chunk_result)
+            n_errors += len(errors)
+
+        if n_workers == 1:
+            for chunk in _chunks(todo(), chunksize):
+                collect(_diff_chunk(chunk, backend, budget, profile))
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                in_flight = deque()
+                for chunk in _chunks(todo(), chunksize):
+                    in_flight.append(executor.submit(_diff_chunk, chunk, backend, budget, profile))
+                    if len(in_flight) >= 2 * n_workers:
+                        collect(in_flight.popleft().result())
+                while in_flight:
+                    collect(in_flight.popleft().result())
+        writer.flush()
+
+    result = StreamResult(
+        parts=writer.parts, n_pairs=n_pairs, n_skipped=n_skipped, n_errors=n_errors, elapsed=time.perf_counter() - ts,
+        profile=_merge_profiles(profiles),
+    )
+    logger.info(
+        f"compared {result.n_pairs} pairs in {result.elapsed:.2f} s ({result.throughput:.2f} pairs/s) "
+        f"with {n_workers} workers, {n_skipped} skipped, {n_errors} failed, "
+        f"reports written to {len(result.parts)} parts in {output_dir}"
+    )
+    return result
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="compare pairs of ORD reactions")
+    parser.add_argument(
+        "inputs", nargs="+",
+        help="a pairs file (.json or .jsonl) of [rid, reaction 1 json, reaction 2 json], or two ORD dataset files"
+    )
+    parser.add_argument("-o", "--output", default="report.csv", help="output csv of the merged report")
+    parser.add_argument(
+        "--output-dir", default=None,
+        help="stream reports to part files in this folder instead of writing one csv at the end, "
+             "rerunning with the same folder resumes the run"
+    )
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet"], help="format of the part files")
+    parser.add_argument("--part-size", type=int, default=100_000, help="number of report rows per part file")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of processes")
+    parser.add_argument("--chunksize", type=int, default=16, help="number of pairs per task")
+    parser.add_argument("--backend", default=DiffBackend.DEEPDIFF.value, choices=[b.value for b in DiffBackend])
+    parser.add_argument("--max-seconds", type=float, default=None, help="time budget of each list comparison")
+    parser.add_argument(
+        "--max-list-size", type=int, default=None, help="longer lists are matched greedily instead of optimally"
+    )
+    parser.add_argument(
+        "--max-leafs", type=int, default=None, help="larger message pairs are compared with a hash-only diff"
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="collect stage timings and counters, logged at the end of the run"
+    )
+    args = parser.parse_args(argv)
+    budget = None
+    if any(v is not None for v in (args.max_seconds, args.max_list_size, args.max_leafs)):
+        budget = DiffBudget(max_seconds=args.max_seconds, max_list_size=args.max_list_size, max_leafs=args.max_leafs)
+
+    if len(args.inputs) == 1:
+        pairs = iter_pairs(args.inputs[0])
+    elif len(args.inputs) == 2:
+        pairs = iter_dataset_pairs(*args.inputs)
+    else:
+        parser.error("expecting one pairs file or two dataset files")
+
+    if args.output_dir:
+        result = stream_diff_pairs(
+            pairs, args.output_dir, n_workers=args.workers, chunksize=args.chunksize,
+            part_size=args.part_size, output_format=args.format, backend=DiffBackend(args.backend),
+            budget=budget, profile=args.profile,
+        )
+        if result.profile is not None:
+            logger.info(f"profile:\n{result.profile.summary()}")
+        return
+
+    result = diff_pairs(
+        list(pairs), n_workers=args.workers, chunksize=args.chunksize, backend=DiffBackend(args.backend),
+        budget=budget, profile=args.profile,
+    )
+    if result.profile is not None:
+        logger.info(f"profile:\n{result.profile.summary()}")
+    result.report.to_csv(args.output, index=False)
+    if result.errors:
+        with open(f"{args.output}.errors.json", "w") as f:
+            json.dump([e.model_dump() for e in result.errors], f, indent=2)
+        logger.warning(f"{len(result.errors)} pairs failed, see {args.output}.errors.json")
+
+
+if __name__ == "__main__":
+    main()
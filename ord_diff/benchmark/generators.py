@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import random
+
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import Message
+from ord_schema.proto import reaction_pb2
+
+COMPOUND_NAMES = [
+    "water", "benzene", "toluene", "THF", "methanol", "ethanol", "acetone", "DMF", "DMSO", "dichloromethane",
+    "sodium hydroxide", "hydrochloric acid", "potassium carbonate", "triethylamine", "palladium acetate",
+]
+""" names of synthetic compounds, a suffix is added once they are used up so names stay unique in a list """
+
+_SMILES_ATOMS = ["C", "C", "C", "O", "N", "c1ccccc1", "Cl", "Br", "F", "S"]
+
+_IDENTIFIER_TYPES = ["SMILES", "INCHI", "CAS_NUMBER", "PUBCHEM_CID", "IUPAC_NAME", "MOLBLOCK", "CUSTOM"]
+
+_ROLES = ["REACTANT", "REAGENT", "SOLVENT", "CATALYST"]
+
+_WORKUP_TYPES = ["ADDITION", "WASH", "EXTRACTION", "FILTRATION", "DRY_WITH_MATERIAL", "CONCENTRATION", "TEMPERATURE"]
+
+
+def random_smiles(rng: random.Random, n_atoms: int = 6) -> str:
+    return "".join(rng.choice(_SMILES_ATOMS) for _ in range(n_atoms))
+
+
+def random_compound(rng: random.Random, name: str, n_identifiers: int = 1) -> reaction_pb2.Compound:
+    """
+    a compound with a name, a smiles, an amount and a role
+
+    :param rng: the random generator
+    :param name: the compound name
+    :param n_identifiers: number of identifiers besides the name, controls the number of leafs
+    """
+    c = reaction_pb2.Compound()
+    c.identifiers.add(type="NAME", value=name)
+    for i in range(n_identifiers):
+        identifier_type = _IDENTIFIER_TYPES[i % len(_IDENTIFIER_TYPES)]
+        c.identifiers.add(type=identifier_type, value=random_smiles(rng, rng.randint(4, 12)))
+    amount_field = rng.choice(["mass", "moles", "volume"])
+    amount = getattr(c.amount, amount_field)
+    amount.value = round(rng.uniform(0.1, 100), 2)
+    amount.units = 1
+    c.reaction_role = reaction_pb2.ReactionRole.ReactionRoleType.Value(rng.choice(_ROLES))
+    return c
+
+
+def random_compound_list(rng: random.Random, n_compounds: int, n_identifiers: int = 1) -> list[reaction_pb2.Compound]:
+    names = []
+    for i in range(n_compounds):
+        name = COMPOUND_NAMES[i % len(COMPOUND_NAMES)]
+        names.append(name if i < len(COMPOUND_NAMES) else f"{name} {i // len(COMPOUND_NAMES)}")
+    return [random_compound(rng, name, n_identifiers) for name in names]
+
+
+def random_workup(rng: random.Random, n_components: int = 1) -> reaction_pb2.ReactionWorkup:
+    """ a workup step with a type, details, duration, temperature and `n_components` input compounds """
+    w = reaction_pb2.ReactionWorkup()
+    w.type = reaction_pb2.ReactionWorkup.ReactionWorkupType.Value(rng.choice(_WORKUP_TYPES))
+    w.details = f"step {rng.randint(1, 100)}"
+    w.duration.value = rng.randint(1, 60)
+    w.duration.units = reaction_pb2.Time.MINUTE
+    w.temperature.setpoint.value = rng.randint(-20, 120)
+    w.temperature.setpoint.units = reaction_pb2.Temperature.CELSIUS
+    w.input.components.extend(random_compound_list(rng, n_components))
+    return w
+
+
+def random_reaction(
+        rng: random.Random, n_inputs: int = 4, n_workups: int = 2, n_products: int = 1, n_identifiers: int = 1
+) -> reaction_pb2.Reaction:
+    """ a reaction with one input per compound, conditions, workups and one outcome """
+    r = reaction_pb2.Reaction()
+    for i, c in enumerate(random_compound_list(rng, n_inputs, n_identifiers)):
+        r.inputs[f"m{i}"].components.append(c)
+    r.conditions.temperature.setpoint.value = rng.randint(-20, 120)
+    r.conditions.temperature.setpoint.units = reaction_pb2.Temperature.CELSIUS
+    r.workups.extend(random_workup(rng) for _ in range(n_workups))
+    outcome = r.outcomes.add()
+    for i in range(n_products):
+        outcome.products.add().identifiers.add(type="SMILES", value=random_smiles(rng))
+    return r
+
+
+def _perturb_scalar(rng: random.Random, field: FieldDescriptor, value):
+    if field.type == FieldDescriptor.TYPE_ENUM:
+        numbers = [v.number for v in field.enum_type.values if v.number != value]
+        return rng.choice(numbers) if numbers else value
+    if field.type == FieldDescriptor.TYPE_BOOL:
+        return not value
+    if field.type == FieldDescriptor.TYPE_STRING:
+        return value + rng.choice("abcxyz")
+    if field.type in (FieldDescriptor.TYPE_FLOAT, FieldDescriptor.TYPE_DOUBLE):
+        return round(value * rng.uniform(0.5, 1.5) + 1, 2)
+    if field.type in (FieldDescriptor.TYPE_INT32, FieldDescriptor.TYPE_INT64):
+        return value + 1
+    return value
+
+
+KEPT_FIELDS = frozenset({reaction_pb2.CompoundIdentifier.DESCRIPTOR.fields_by_name["type"].full_name})
+""" fields never perturbed, identifier types tell which identifier is the compound name """
+
+
+def perturb(message: Message, rng: random.Random, fraction: float, kept_fields=KEPT_FIELDS) -> Message:
+    """
+    a copy of a message with about `fraction` of its scalar fields changed, e.g. a string gets an extra character,
+    a number is scaled and an enum takes another value, repeated scalar fields are left as is
+
+    :param message: the message
+    :param rng: the random generator
+    :param fraction: probability of changing each scalar field
+    :param kept_fields: full names of the fields that are not changed
+    """
+    message = type(message).FromString(message.SerializeToString())
+    stack = [message]
+    while stack:
+        m = stack.pop()
+        for field, value in m.ListFields():
+            if field.type == FieldDescriptor.TYPE_MESSAGE:
+                if field.message_type.GetOptions().map_entry:
+                    stack.extend(value.values())
+                elif field.label == FieldDescriptor.LABEL_REPEATED:
+                    stack.extend(value)
+                else:
+                    stack.append(value)
+            elif field.label == FieldDescriptor.LABEL_REPEATED or field.full_name in kept_fields:
+                continue
+            elif rng.random() < fraction:
+                setattr(m, field.name, _perturb_scalar(rng, field, value))
+    return message
+
+
+def perturb_list(messages: list[Message], rng: random.Random, fraction: float) -> list[Message]:
+    """ perturbed copies of messages in a shuffled order """
+    messages = [perturb(m, rng, fraction) for m in messages]
+    rng.shuffle(messages)
+    return messages
+
+
+def compound_pair(seed: int, n_identifiers: int = 1, fraction: float = 0.2):
+    """ a compound and its perturbed copy """
+    rng = random.Random(seed)
+    c = random_compound(rng, rng.choice(COMPOUND_NAMES), n_identifiers)
+    return c, perturb(c, rng, fraction)
+
+
+def compound_list_pair(seed: int, n_compounds: int, n_identifiers: int = 1, fraction: float = 0.2):
+    """ a list of compounds and its perturbed and shuffled copy """
+    rng = random.Random(seed)
+    compounds = random_compound_list(rng, n_compounds, n_identifiers)
+    return compounds, perturb_list(compounds, rng, fraction)
+
+
+def workup_list_pair(seed: int, n_workups: int, n_components: int = 1, fraction: float = 0.2):
+    """ a list of workups and its perturbed copy, in the same order as workups are ordered steps """
+    rng = random.Random(seed)
+    workups = [random_workup(rng, n_components) for _ in range(n_workups)]
+    return workups, [perturb(w, rng, fraction) for w in workups]
+
+
+def reaction_pair(seed: int, n_inputs: int = 4, n_workups: int = 2, n_identifiers: int = 1, fraction: float = 0.2):
+    """ a reaction and its perturbed copy """
+    rng = random.Random(seed)
+    r = random_reaction(rng, n_inputs, n_workups, n_identifiers=n_identifiers)
+    return r, perturb(r, rng, fraction)
@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel
+
+from ord_diff.base import MessageType
+from ord_diff.benchmark.generators import compound_pair, compound_list_pair, workup_list_pair, reaction_pair
+from ord_diff.reaction import ReactionDiff, REACTION_PART_MATCHING
+from ord_diff.report import report_diff_list
+from ord_diff.schema import MDict, MDictDiff, MDictListDiff
+from ord_diff.text import TextIndex
+from ord_diff.utils import find_best_match
+
+
+def _prepare_md_pair(size: int, seed: int) -> Callable:
+    c1, c2 = compound_pair(seed, n_identifiers=size)
+    md1 = MDict.from_message(c1, MessageType.COMPOUND)
+    md2 = MDict.from_message(c2, MessageType.COMPOUND)
+    return lambda: MDictDiff.from_md_pair(md1, md2)
+
+
+def _prepare_md_list_pair(size: int, seed: int) -> Callable:
+    c1_list, c2_list = compound_list_pair(seed, n_compounds=size)
+    md1_list = [MDict.from_message(c, MessageType.COMPOUND) for c in c1_list]
+    md2_list = [MDict.from_message(c, MessageType.COMPOUND) for c in c2_list]
+    return lambda: MDictListDiff.from_md_list_pair(md1_list, md2_list)
+
+
+def _prepare_workup_list_pair(size: int, seed: int) -> Callable:
+    w1_list, w2_list = workup_list_pair(seed, n_workups=size)
+    md1_list = [MDict.from_message(w, MessageType.REACTION_WORKUP) for w in w1_list]
+    md2_list = [MDict.from_message(w, MessageType.REACTION_WORKUP) for w in w2_list]
+    matching = REACTION_PART_MATCHING[MessageType.REACTION_WORKUP]
+    return lambda: MDictListDiff.from_md_list_pair(md1_list, md2_list, matching=matching)
+
+
+def _prepare_find_best_match(size: int, seed: int) -> Callable:
+    rng = np.random.default_rng(seed)
+    distance_matrix = rng.random((size, size)).tolist()
+    indices = list(range(size))
+    return lambda: find_best_match(indices, indices, distance_matrix)
+
+
+def _prepare_report_diff_list(size: int, seed: int) -> Callable:
+    c1_list, c2_list = compound_list_pair(seed, n_compounds=size)
+    list_diff = MDictListDiff.from_message_list_pair(c1_list, c2_list, MessageType.COMPOUND)
+    return lambda: report_diff_list(list_diff, MessageType.COMPOUND)
+
+
+def _prepare_text_index(size: int, seed: int) -> Callable:
+    c1_list, c2_list = compound_list_pair(seed, n_compounds=size)
+    text = "\n".join(str(c) for c in c1_list)
+    values = [v for c in c2_list for v in MDict.from_message(c, MessageType.COMPOUND).table.values]
+    return lambda: TextIndex(text).explicit_mask(values)
+
+
+def _prepare_reaction_diff(size: int, seed: int) -> Callable:
+    r1, r2 = reaction_pair(seed, n_inputs=size, n_workups=max(1, size // 2))
+    return lambda: ReactionDiff.from_reaction_pair(r1, r2)
+
+
+STAGES: dict[str, Callable[[int, int], Callable]] = {
+    "md_pair": _prepare_md_pair,
+    "md_list_pair": _prepare_md_list_pair,
+    "workup_list_pair": _prepare_workup_list_pair,
+    "find_best_match": _prepare_find_best_match,
+    "report_diff_list": _prepare_report_diff_list,
+    "reaction_diff": _prepare_reaction_diff,
+    "text_index": _prepare_text_index,
+}
+"""
+stage name -> prepare(size, seed), which generates the inputs outside the timed region and returns the timed call,
+`size` is the number of identifiers per compound for `md_pair`, the number of rows for `find_best_match`,
+the number of input compounds for `reaction_diff` and the list length otherwise,
+`text_index` indexes the text format of a compound list and looks up the leaf values of its perturbed copy
+"""
+
+DEFAULT_SIZES = [2, 4, 8, 16]
+
+IMPORT_MODULES = ["ord_diff.schema", "ord_diff.report", "ord_diff.batch"]
+""" modules whose import time is measured, in fresh interpreters, workers and CLI invocations pay it on startup """
+
+
+class StageResult(BaseModel):
+    """ time and memory of one stage at one size """
+
+    stage: str
+
+    size: int
+
+    seconds: float
+    """ the fastest of the repeats, in seconds """
+
+    peak_bytes: int
+    """ peak memory allocated by python during one call, measured by `tracemalloc` """
+
+
+class BenchmarkResults(BaseModel):
+    """ results of a benchmark run, stored as json """
+
+    machine: dict[str, str]
+    """ where the results were measured, timings are only comparable on the same machine """
+
+    results: list[StageResult]
+
+    def to_file(self, path: str | os.PathLike):
+        with open(path, "w") as f:
+            f.write(self.model_dump_json(indent=2))
+
+    @classmethod
+    def from_file(cls, path: str | os.PathLike):
+        with open(path, "r") as f:
+            return cls.model_validate(json.load(f))
+
+
+class Regression(BaseModel):
+    """ a stage that got slower or uses more memory than in the baseline """
+
+    stage: str
+
+    size: int
+
+    metric: str
+    """ `seconds` or `peak_bytes` """
+
+    baseline: float
+
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+def measure(prepare: Callable[[int, int], Callable], size: int, repeat: int = 3, seed: int = 42) -> tuple[float, int]:
+    """
+    measure a stage, every repeat is timed on fresh inputs as messages cache their hashes and keys
+
+    :return: the fastest time in seconds, the peak memory in bytes
+    """
+    times = []
+    for _ in range(repeat):
+        call = prepare(size, seed)
+        gc.collect()
+        ts = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - ts)
+    call = prepare(size, seed)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def measure_import(module: str, repeat: int = 3) -> float:
+    """ the fastest time in seconds to import a module in a fresh interpreter, not including the interpreter start """
+    code = f"import time; ts = time.perf_counter(); import {module}; print(time.perf_counter() - ts)"
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        times.append(float(output))
+    return min(times)
+
+
+def run_benchmarks(
+        stages: list[str] | None = None, sizes: list[int] | None = None, repeat: int = 3, seed: int = 42,
+        imports: list[str] = (),
+) -> BenchmarkResults:
+    """
+    run stages over a sweep of sizes
+
+    :param stages: names of the stages, default to all, see `STAGES`
+    :param sizes: the sweep, default to `DEFAULT_SIZES`
+    :param repeat: number of timed calls per stage and size
+    :param seed: the seed of the synthetic inputs
+    :param imports: modules whose import time is recorded as the stage `import <module>` of size 0,
+        e.g. `IMPORT_MODULES`
+    """
+    stages = list(STAGES) if stages is None else stages
+    sizes = DEFAULT_SIZES if sizes is None else sizes
+    results = []
+    for stage in stages:
+        for size in sizes:
+            seconds, peak_bytes = measure(STAGES[stage], size, repeat, seed)
+            logger.info(f"{stage} size={size}: {seconds * 1e3:.2f} ms, {peak_bytes / 1024:.1f} KiB")
+            results.append(StageResult(stage=stage, size=size, seconds=seconds, peak_bytes=peak_bytes))
+    for module in imports:
+        seconds = measure_import(module, repeat)
+        logger.info(f"import {module}: {seconds * 1e3:.2f} ms")
+        results.append(StageResult(stage=f"import {module}", size=0, seconds=seconds, peak_bytes=0))
+    machine = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+    }
+    return BenchmarkResults(machine=machine, results=results)
+
+
+def compare_results(
+        current: BenchmarkResults,
+        baseline: BenchmarkResults,
+        tolerance: float = 0.25,
+        min_seconds: float = 1e-3,
+) -> list[Regression]:
+    """
+    find regressions against a baseline, stages and sizes missing in either run are ignored
+
+    :param current: the new results
+    :param baseline: the stored results
+    :param tolerance: allowed relative increase of time and memory
+    :param min_seconds: increases in time smaller than this are timer noise and ignored
+    """
+    baseline_results = {(r.stage, r.size): r for r in baseline.results}
+    regressions = []
+    for r in current.results:
+        b = baseline_results.get((r.stage, r.size))
+        if b is None:
+            continue
+        if r.seconds > b.seconds * (1 + tolerance) and r.seconds - b.seconds > min_seconds:
+            regressions.append(Regression(stage=r.stage, size=r.size, metric="seconds", baseline=b.seconds,
+                                          current=r.seconds))
+        if r.peak_bytes > b.peak_bytes * (1 + tolerance):
+            regressions.append(Regression(stage=r.stage, size=r.size, metric="peak_bytes", baseline=b.peak_bytes,
+                                          current=r.peak_bytes))
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="benchmark ord_diff on synthetic messages")
+    parser.add_argument("-o", "--output", default="benchmark.json", help="output json of the results")
+    parser.add_argument("--stages", nargs="+", default=None, choices=list(STAGES), help="default to all stages")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="the size sweep")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed calls per stage and size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--imports", nargs="*", default=IMPORT_MODULES, help="modules whose import time is measured")
+    parser.add_argument("--baseline", default=None, help="compare with the results in this json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative increase")
+    parser.add_argument(
+        "--update-baseline", action="store_true", help="write the results to the baseline file after comparing"
+    )
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.stages, args.sizes, args.repeat, args.seed, args.imports)
+    results.to_file(args.output)
+    if args.baseline is None:
+        return 0
+    regressions = []
+    if os.path.isfile(args.baseline):
+        regressions = compare_results(results, BenchmarkResults.from_file(args.baseline), args.tolerance)
+        for r in regressions:
+            logger.warning(
+                f"{r.stage} size={r.size}: {r.metric} {r.baseline:.4g} -> {r.current:.4g} ({r.ratio:.2f}x)"
+            )
+    if args.update_baseline:
+        results.to_file(args.baseline)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
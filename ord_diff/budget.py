@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import time
+
+from deepdiff import DeepDiff
+from pydantic import BaseModel
+
+
+class DiffBudget(BaseModel):
+    """
+    limits of a comparison (a pair of messages or a pair of message lists),
+    instead of running for an unbounded time, a comparison exceeding its budget falls back to a cheaper method
+    and the result is flagged with `is_approximate`
+    """
+
+    max_seconds: float | None = None
+    """
+    wall time of a comparison, checked between deepdiff calls, once exceeded,
+    remaining pairs are compared with the hash-only diff (`utils.flat_diff`)
+    """
+
+    max_list_size: int | None = None
+    """ lists longer than this are matched greedily (`utils.find_greedy_match`) instead of optimally """
+
+    max_leafs: int | None = None
+    """ pairs with more leafs (summed over the two messages) are compared with the hash-only diff """
+
+    max_passes: int | None = None
+    """ passed to deepdiff, max number of passes to pair items of unordered iterables """
+
+    max_diffs: int | None = None
+    """ passed to deepdiff, max number of diffs reported, deepdiff stops early when reached """
+
+    def start(self) -> BudgetTracker:
+        """ start the clock for a comparison """
+        return BudgetTracker(self)
+
+
+class BudgetTracker:
+    """ the state of a `DiffBudget` in a running comparison """
+
+    def __init__(self, budget: DiffBudget):
+        self.budget = budget
+        self.started = time.perf_counter()
+        self.reasons: list[str] = []
+        """ why the comparison is approximate """
+
+    @staticmethod
+    def of(budget: DiffBudget | BudgetTracker | None) -> BudgetTracker | None:
+        """ start a budget, or use an already running one """
+        if isinstance(budget, DiffBudget):
+            return budget.start()
+        return budget
+
+    @property
+    def is_approximate(self) -> bool:
+        return len(self.reasons) > 0
+
+    def degrade(self, reason: str):
+        """ record a fallback to a cheaper method """
+        if reason not in self.reasons:
+            self.reasons.append(reason)
+
+    def is_expired(self) -> bool:
+        return self.budget.max_seconds is not None and time.perf_counter() - self.started > self.budget.max_seconds
+
+    def is_list_too_long(self, n1: int, n2: int) -> bool:
+        return self.budget.max_list_size is not None and max(n1, n2) > self.budget.max_list_size
+
+    def is_pair_too_large(self, n_leafs1: int, n_leafs2: int) -> bool:
+        return self.budget.max_leafs is not None and n_leafs1 + n_leafs2 > self.budget.max_leafs
+
+    def check_pair(self, md1, md2) -> bool:
+        """ if a pair of `MDict` can be compared exactly, record the reason if not """
+        if self.is_expired():
+            self.degrade("max_seconds")
+            return False
+        if self.is_pair_too_large(md1.n_leafs, md2.n_leafs):
+            self.degrade("max_leafs")
+            return False
+        return True
+
+    def deepdiff_kwargs(self) -> dict:
+        kwargs = dict()
+        if self.budget.max_passes is not None:
+            kwargs['max_passes'] = self.budget.max_passes
+        if self.budget.max_diffs is not None:
+            kwargs['max_diffs'] = self.budget.max_diffs
+        return kwargs
+
+    def check_deepdiff(self, dd: DeepDiff) -> bool:
+        """ if deepdiff finished within its limits, record the reason if not """
+        stats = dd.get_stats()
+        if stats.get('MAX PASS LIMIT REACHED'):
+            self.degrade("max_passes")
+            return False
+        if stats.get('MAX DIFF LIMIT REACHED'):
+            self.degrade("max_diffs")
+            return False
+        return True
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import os
+import pickle
+from collections import OrderedDict
+from enum import Enum
+
+from ord_diff.base import DiffBackend
+from ord_diff.profiling import count
+from ord_diff.utils import ParsedDiff
+
+
+class CacheEntryType(str, Enum):
+    """ what is stored in a `DiffCache` """
+
+    # deep distance between two messages, keyed by content hashes that are order-insensitive for deepdiff,
+    # the native backend compares `ORDERED_REPEATED_FIELDS` in order
+    DISTANCE = "DISTANCE"
+
+    # parsed deepdiff between two messages, keyed by order-sensitive content hashes
+    # as leaf paths contain list indices
+    DIFF = "DIFF"
+
+
+class DiffCache:
+    """
+    a bounded LRU cache for comparisons between messages, shared across message pairs, lists and datasets
+
+    entries are keyed by content hashes of `MDict.d` so identical compounds/workups from different
+    reactions hit the same entry, see `MDict.content_hash`, and by the diff backend as backends
+    may not give the same distance
+    """
+
+    def __init__(self, maxsize: int = 100_000, store_diffs: bool = False):
+        """
+        :param maxsize: max number of entries (distances and diffs combined), least recently used are evicted
+        :param store_diffs: if parsed diffs should be cached in addition to deep distances
+        """
+        self.maxsize = maxsize
+        self.store_diffs = store_diffs
+        self._entries: OrderedDict[tuple[CacheEntryType, DiffBackend, str, str], float | ParsedDiff] = OrderedDict()
+        self.hits = {t: 0 for t in CacheEntryType}
+        self.misses = {t: 0 for t in CacheEntryType}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(md1, md2, entry_type: CacheEntryType, backend: DiffBackend):
+        # distances ignore order like the backend does, see `MDictDiff.is_identical`
+        ignore_order = entry_type == CacheEntryType.DISTANCE and backend == DiffBackend.DEEPDIFF
+        return entry_type, backend, md1.content_hash(ignore_order), md2.content_hash(ignore_order)
+
+    def _get(self, key):
+        entry_type = key[0]
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses[entry_type] += 1
+            count(f"cache.{entry_type.value.lower()}_misses")
+            return None
+        self._entries.move_to_end(key)
+        self.hits[entry_type] += 1
+        count(f"cache.{entry_type.value.lower()}_hits")
+        return value
+
+    def _set(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get_distance(self, md1, md2, backend: DiffBackend = DiffBackend.DEEPDIFF) -> float | None:
+        """ cached deep distance between two `MDict`, None if not cached """
+        return self._get(self._key(md1, md2, CacheEntryType.DISTANCE, backend))
+
+    def set_distance(self, md1, md2, distance: float, backend: DiffBackend = DiffBackend.DEEPDIFF):
+        self._set(self._key(md1, md2, CacheEntryType.DISTANCE, backend), distance)
+
+    def get_diff(self, md1, md2, backend: DiffBackend = DiffBackend.DEEPDIFF) -> ParsedDiff | None:
+        """ cached parsed diff between two `MDict`, None if not cached or diffs are not stored """
+        if not self.store_diffs:
+            return None
+        return self._get(self._key(md1, md2, CacheEntryType.DIFF, backend))
+
+    def set_diff(self, md1, md2, parsed_diff: ParsedDiff, backend: DiffBackend = DiffBackend.DEEPDIFF):
+        if self.store_diffs:
+            self._set(self._key(md1, md2, CacheEntryType.DIFF, backend), parsed_diff)
+
+    @property
+    def stats(self) -> dict[str, int | float]:
+        """ hit/miss statistics """
+        n_hits = sum(self.hits.values())
+        n_misses = sum(self.misses.values())
+        stats = {"size": len(self), "hits": n_hits, "misses": n_misses}
+        for t in CacheEntryType:
+            stats[f"{t.value.lower()}_hits"] = self.hits[t]
+            stats[f"{t.value.lower()}_misses"] = self.misses[t]
+        stats["hit_rate"] = n_hits / (n_hits + n_misses) if n_hits + n_misses else 0.0
+        return stats
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = {t: 0 for t in CacheEntryType}
+        self.misses = {t: 0 for t in CacheEntryType}
+
+    def save(self, path: str | os.PathLike):
+        """ write the entries to a local file so later runs can start warm """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(
+                {"maxsize": self.maxsize, "store_diffs": self.store_diffs, "entries": list(self._entries.items())},
+                f, protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, maxsize: int | None = None) -> DiffCache:
+        """ load a cache written by `save`, only load files you wrote yourself """
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        cache = cls(maxsize=data["maxsize"] if maxsize is None else maxsize, store_diffs=data["store_diffs"])
+        for key, value in data["entries"]:
+            cache._set(key, value)
+        return cache
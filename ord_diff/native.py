@@ -0,0 +1,231 @@
+from __future__ import annotations
+
+from collections.abc import MutableMapping
+
+from ord_diff.base import ORDERED_REPEATED_FIELDS
+from ord_diff.utils import ParsedDiff, content_hash, flat_deepdiff_entry, find_best_match
+
+_ADDED = 0
+_REMOVED = 1
+_ALTERED = 2
+
+
+def rough_length(t) -> int:
+    """ number of containers, keys and literals in `t`, same as the item length used by deepdiff """
+    if isinstance(t, MutableMapping):
+        return 1 + sum(1 + rough_length(v) for v in t.values())
+    if isinstance(t, list):
+        return 1 + sum(rough_length(v) for v in t)
+    return 1
+
+
+def n_leafs(t) -> int:
+    """ number of leafs in `t`, an empty dict/list is one (`None`) leaf, see `utils.flatten` """
+    if isinstance(t, MutableMapping):
+        return sum(n_leafs(v) for v in t.values()) or 1
+    if isinstance(t, list):
+        return sum(n_leafs(v) for v in t) or 1
+    return 1
+
+
+class NativeDiffer:
+    """
+    a diff engine for message dictionaries (the output of `json_format.MessageToDict`)
+
+    compared to deepdiff it only handles dicts, lists and literals, and it knows which repeated fields are ordered:
+    - dict: keys are compared by name
+    - list of an ordered field (see `base.ORDERED_REPEATED_FIELDS`): items are compared by index
+    - list of other fields: identical items (by content hash) are paired first, the rest are paired by minimizing
+      the sum of distances, pairs whose distance is no less than `cutoff_distance_for_pairs` are reported as
+      removed + added, similar to `ignore_order=True` in deepdiff; as in deepdiff, no pairing is attempted
+      if the fraction of changed items exceeds `cutoff_intersection_for_pairs`, and an unpaired item removed
+      from and an unpaired item added to the same index are reported as one altered item
+
+    the distance is (number of operations) / (rough length of t1 + rough length of t2),
+    it is 0 iff t1 == t2 and is close to, but not always the same as, the deep distance from deepdiff
+
+    known differences from deepdiff: repeated identical items are reported (deepdiff ignores repetitions), and
+    items are paired by an optimal assignment instead of greedily, so ties can be broken differently
+    """
+
+    def __init__(
+            self,
+            ordered_fields: frozenset[str] = ORDERED_REPEATED_FIELDS,
+            cutoff_distance_for_pairs: float = 0.3,
+            cutoff_intersection_for_pairs: float = 0.7,
+    ):
+        self.ordered_fields = ordered_fields
+        self.cutoff_distance_for_pairs = cutoff_distance_for_pairs
+        self.cutoff_intersection_for_pairs = cutoff_intersection_for_pairs
+        self._pair_memo: dict[tuple[str, str], tuple[list, int]] = dict()
+
+    def diff(self, t1, t2) -> ParsedDiff:
+        """ compare two message dictionaries """
+        ops, n_ops = self._diff(t1, t2, None)
+        if n_ops == 0:
+            deep_distance = 0
+        else:
+            deep_distance = n_ops / (rough_length(t1) + rough_length(t2))
+
+        paths_added, paths_removed, paths_altered_1, paths_altered_2 = [], [], [], []
+        leaf_paths_added, leaf_paths_removed, leaf_paths_altered_1, leaf_paths_altered_2 = [], [], [], []
+        for op, path1, path2, sub1, sub2 in ops:
+            if op == _ADDED:
+                paths_added.append(list(path2))
+                leaf_paths_added += list(flat_deepdiff_entry(sub2, list(path2)).keys())
+            elif op == _REMOVED:
+                paths_removed.append(list(path1))
+                leaf_paths_removed += list(flat_deepdiff_entry(sub1, list(path1)).keys())
+            else:
+                paths_altered_1.append(list(path1))
+                paths_altered_2.append(list(path2))
+                leaf_paths_altered_1 += list(flat_deepdiff_entry(sub1, list(path1)).keys())
+                leaf_paths_altered_2 += list(flat_deepdiff_entry(sub2, list(path2)).keys())
+        return ParsedDiff(
+            deep_distance,
+            paths_added, paths_removed, paths_altered_1, paths_altered_2,
+            leaf_paths_added, leaf_paths_removed, leaf_paths_altered_1, leaf_paths_altered_2
+        )
+
+    def distance(self, t1, t2) -> float:
+        """ the distance between two message dictionaries """
+        _, n_ops = self._diff(t1, t2, None)
+        if n_ops == 0:
+            return 0
+        return n_ops / (rough_length(t1) + rough_length(t2))
+
+    def _diff(self, t1, t2, field_name: str | None) -> tuple[list, int]:
+        """
+        :return: a list of operations (op, relative path1, relative path2, sub tree 1, sub tree 2),
+            and the number of leaf operations
+        """
+        if isinstance(t1, MutableMapping) and isinstance(t2, MutableMapping):
+            return self._diff_dict(t1, t2)
+        if isinstance(t1, list) and isinstance(t2, list):
+            if field_name in self.ordered_fields:
+                return self._diff_ordered_list(t1, t2)
+            return self._diff_unordered_list(t1, t2)
+        if type(t1) is type(t2):
+            if t1 == t2:
+                return [], 0
+            return [(_ALTERED, (), (), t1, t2)], 1
+        # type change
+        return [(_ALTERED, (), (), t1, t2)], n_leafs(t1) + n_leafs(t2)
+
+    def _diff_dict(self, t1: dict, t2: dict):
+        ops = []
+        n_ops = 0
+        for k, v1 in t1.items():
+            if k not in t2:
+                ops.append((_REMOVED, (k,), None, v1, None))
+                n_ops += n_leafs(v1)
+                continue
+            sub_ops, sub_n_ops = self._diff(v1, t2[k], k)
+            if sub_n_ops:
+                ops += _prefix(sub_ops, (k,), (k,))
+                n_ops += sub_n_ops
+        for k, v2 in t2.items():
+            if k not in t1:
+                ops.append((_ADDED, None, (k,), None, v2))
+                n_ops += n_leafs(v2)
+        return ops, n_ops
+
+    def _diff_ordered_list(self, t1: list, t2: list):
+        ops = []
+        n_ops = 0
+        for i, (v1, v2) in enumerate(zip(t1, t2)):
+            sub_ops, sub_n_ops = self._diff(v1, v2, None)
+            if sub_n_ops:
+                ops += _prefix(sub_ops, (i,), (i,))
+                n_ops += sub_n_ops
+        for i in range(len(t2), len(t1)):
+            ops.append((_REMOVED, (i,), None, t1[i], None))
+            n_ops += n_leafs(t1[i])
+        for i in range(len(t1), len(t2)):
+            ops.append((_ADDED, None, (i,), None, t2[i]))
+            n_ops += n_leafs(t2[i])
+        return ops, n_ops
+
+    def _diff_unordered_list(self, t1: list, t2: list):
+        hashes1 = [content_hash(v, ignore_order=False) for v in t1]
+        hashes2 = [content_hash(v, ignore_order=False) for v in t2]
+
+        # pair identical items first
+        unpaired2: dict[str, list[int]] = dict()
+        for i2, h2 in enumerate(hashes2):
+            unpaired2.setdefault(h2, []).append(i2)
+        rest1 = []
+        for i1, h1 in enumerate(hashes1):
+            if unpaired2.get(h1):
+                unpaired2[h1].pop(0)
+            else:
+                rest1.append(i1)
+        rest2 = sorted(i2 for i2s in unpaired2.values() for i2 in i2s)
+
+        ops = []
+        n_ops = 0
+        pairs = dict()
+        get_pairs = (len(rest1) + len(rest2)) / (len(t1) + len(t2) + 1) <= self.cutoff_intersection_for_pairs
+        if rest1 and rest2 and get_pairs:
+            pair_diffs = dict()
+            distance_matrix = []
+            for i1 in rest1:
+                row = []
+                for i2 in rest2:
+                    sub_ops, sub_n_ops = self._diff_pair(t1[i1], t2[i2], hashes1[i1], hashes2[i2])
+                    pair_diffs[(i1, i2)] = (sub_ops, sub_n_ops)
+                    row.append(sub_n_ops / (rough_length(t1[i1]) + rough_length(t2[i2])))
+                distance_matrix.append(row)
+            indices2 = [*range(len(rest2))]
+            while len(indices2) < len(rest1):
+                indices2.append(None)
+            for k1, k2 in find_best_match([*range(len(rest1))], indices2, distance_matrix).items():
+                if k2 is not None and distance_matrix[k1][k2] < self.cutoff_distance_for_pairs:
+                    pairs[rest1[k1]] = rest2[k2]
+
+        unpaired2 = set(rest2).difference(pairs.values())
+        for i1 in rest1:
+            if i1 in pairs:
+                i2 = pairs[i1]
+                sub_ops, sub_n_ops = pair_diffs[(i1, i2)]
+                ops += _prefix(sub_ops, (i1,), (i2,))
+                n_ops += sub_n_ops
+            elif i1 in unpaired2:
+                unpaired2.remove(i1)
+                ops.append((_ALTERED, (i1,), (i1,), t1[i1], t2[i1]))
+                n_ops += n_leafs(t1[i1]) + n_leafs(t2[i1])
+            else:
+                ops.append((_REMOVED, (i1,), None, t1[i1], None))
+                n_ops += n_leafs(t1[i1])
+        for i2 in rest2:
+            if i2 in unpaired2:
+                ops.append((_ADDED, None, (i2,), None, t2[i2]))
+                n_ops += n_leafs(t2[i2])
+        return ops, n_ops
+
+    def _diff_pair(self, v1, v2, h1: str, h2: str):
+        """ items of unordered lists, memoized by content as the same items appear in many lists """
+        key = (h1, h2)
+        try:
+            return self._pair_memo[key]
+        except KeyError:
+            result = self._diff(v1, v2, None)
+            self._pair_memo[key] = result
+            return result
+
+
+def _prefix(ops: list, prefix1: tuple, prefix2: tuple) -> list:
+    return [
+        (
+            op,
+            None if path1 is None else prefix1 + path1,
+            None if path2 is None else prefix2 + path2,
+            sub1, sub2
+        )
+        for op, path1, path2, sub1, sub2 in ops
+    ]
+
+
+def native_diff(t1, t2, ordered_fields: frozenset[str] = ORDERED_REPEATED_FIELDS) -> ParsedDiff:
+    """ compare two message dictionaries with `NativeDiffer` """
+    return NativeDiffer(ordered_fields=ordered_fields).diff(t1, t2)
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import numpy as np
+
+DISTANCE_UPPER_BOUND = 1.0
+"""
+deep distances between two messages are usually within [0, 1], cells skipped by the prefilter are filled with
+the larger of this and the largest exact distance computed
+"""
+
+
+def leaf_feature(path_tuple: tuple[str | int, ...], value) -> tuple:
+    """
+    a (path, value) feature of a leaf, list indices are dropped from the path
+    as lists are compared ignoring order
+    """
+    return tuple("*" if isinstance(p, int) else p for p in path_tuple), type(value).__name__, value
+
+
+def feature_matrices(m1_list: list, m2_list: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    embed each `MDict` as a binary vector of its leaf features, the vocabulary is shared by the two lists
+
+    :return: two indicator matrices of shape (len(m1_list), n_features) and (len(m2_list), n_features)
+    """
+    vocabulary = dict()
+    rows = []
+    for md in m1_list + m2_list:
+        table = md.table
+        rows.append(
+            [vocabulary.setdefault(leaf_feature(p, v), len(vocabulary)) for p, v in zip(table.paths, table.values)]
+        )
+    features = np.zeros((len(rows), len(vocabulary)), dtype=np.float32)
+    for i, row in enumerate(rows):
+        features[i, row] = 1
+    return features[:len(m1_list)], features[len(m1_list):]
+
+
+def jaccard_matrix(features1: np.ndarray, features2: np.ndarray) -> np.ndarray:
+    """ jaccard similarity between the feature sets of all pairs """
+    intersection = features1 @ features2.T
+    union = features1.sum(axis=1)[:, None] + features2.sum(axis=1)[None, :] - intersection
+    with np.errstate(invalid="ignore", divide="ignore"):
+        jaccard = np.where(union > 0, intersection / union, 1.0)
+    return jaccard
+
+
+def candidate_mask(m1_list: list, m2_list: list, id_mat: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    cells of the distance matrix worth an exact deep distance, these are
+    1. the top k cells of each row and of each column ranked by a cheap surrogate distance,
+       i.e. the identity penalty plus the jaccard distance of leaf features
+    2. the cells with the smallest identity distance of each row and of each column, as the identity penalty
+       dominates the matching distance, e.g. a compound with a unique name only has one such cell,
+       while a compound whose name is not found in the other list is compared with all of them
+
+    :param m1_list: the first list of `MDict`
+    :param m2_list: the second list of `MDict`
+    :param id_mat: identity distances, see `utils.identity_distance_matrix`
+    :param top_k: number of candidates per row/column
+    :return: a boolean matrix of shape (len(m1_list), len(m2_list))
+    """
+    features1, features2 = feature_matrices(m1_list, m2_list)
+    surrogate = id_mat * 100 + 1 - jaccard_matrix(features1, features2)
+    n1, n2 = surrogate.shape
+    mask = (id_mat == id_mat.min(axis=1, keepdims=True)) | (id_mat == id_mat.min(axis=0, keepdims=True))
+    if top_k >= n2:
+        mask[:] = True
+    else:
+        rows = np.argpartition(surrogate, top_k - 1, axis=1)[:, :top_k]
+        mask[np.arange(n1)[:, None], rows] = True
+    if top_k >= n1:
+        mask[:] = True
+    else:
+        cols = np.argpartition(surrogate, top_k - 1, axis=0)[:top_k, :]
+        mask[cols, np.arange(n2)[None, :]] = True
+    return mask
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import contextlib
+import functools
+import threading
+import time
+from collections.abc import Iterable
+from typing import Callable
+
+from pydantic import BaseModel
+
+Hook = Callable[[str, str, float], None]
+""" called with (kind, name, value) for each record, kind is `stage` (value in seconds) or `count` """
+
+_PROFILERS: list[Profiler] = []
+""" active profilers, records go to all of them, nothing is recorded if empty """
+
+_LOCK = threading.Lock()
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class StageStats(BaseModel):
+    """ timing of a stage """
+
+    calls: int = 0
+
+    seconds: float = 0.0
+    """ total wall time, including nested stages """
+
+
+class Profile(BaseModel):
+    """ timings and counters collected by a `Profiler`, merged across comparisons, chunks or workers """
+
+    stages: dict[str, StageStats] = dict()
+    """ stage name -> timing, e.g. `message_to_dict`, `distance_matrix`, `matching`, `report` """
+
+    counters: dict[str, int] = dict()
+    """ counter name -> total, e.g. `distance_matrix.cells`, `cache.distance_hits`, `matching.size` """
+
+    def merge(self, other: Profile) -> Profile:
+        """ add the records of another profile to this one """
+        for name, stats in other.stages.items():
+            mine = self.stages.setdefault(name, StageStats())
+            mine.calls += stats.calls
+            mine.seconds += stats.seconds
+        for name, n in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + n
+        return self
+
+    def hit_rate(self, prefix: str = "cache") -> float | None:
+        """ hits / (hits + misses) of the counters `<prefix>.*_hits` and `<prefix>.*_misses`, None if no lookup """
+        hits = sum(n for k, n in self.counters.items() if k.startswith(f"{prefix}.") and k.endswith("_hits"))
+        misses = sum(n for k, n in self.counters.items() if k.startswith(f"{prefix}.") and k.endswith("_misses"))
+        return hits / (hits + misses) if hits + misses else None
+
+    def summary(self) -> str:
+        """ one line per stage, slowest first, then the counters """
+        lines = [
+            f"{name}: {stats.calls} calls, {stats.seconds:.4f} s"
+            for name, stats in sorted(self.stages.items(), key=lambda x: -x[1].seconds)
+        ]
+        lines += [f"{name}: {n}" for name, n in sorted(self.counters.items())]
+        return "\n".join(lines)
+
+
+class Profiler:
+    """
+    opt-in instrumentation of the diff pipeline, records are collected while the profiler is active
+
+        with Profiler() as profiler:
+            MDictListDiff.from_message_list_pair(...)
+        print(profiler.profile.summary())
+
+    profilers are process-wide so stages running on worker threads are recorded,
+    for process pools collect a profile in each task and `Profile.merge` them
+    """
+
+    def __init__(self, hooks: Iterable[Hook] = ()):
+        """ :param hooks: called for each record, e.g. `loguru_hook()` """
+        self.profile = Profile()
+        self.hooks = list(hooks)
+
+    def __enter__(self):
+        with _LOCK:
+            _PROFILERS.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with _LOCK:
+            _PROFILERS.remove(self)
+
+    def _record_stage(self, name: str, seconds: float):
+        with _LOCK:
+            stats = self.profile.stages.setdefault(name, StageStats())
+            stats.calls += 1
+            stats.seconds += seconds
+        for hook in self.hooks:
+            hook("stage", name, seconds)
+
+    def _record_count(self, name: str, n: int):
+        with _LOCK:
+            self.profile.counters[name] = self.profile.counters.get(name, 0) + n
+        for hook in self.hooks:
+            hook("count", name, n)
+
+
+class _StageTimer:
+    __slots__ = ("name", "ts")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.ts = None
+
+    def __enter__(self):
+        self.ts = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        seconds = time.perf_counter() - self.ts
+        for profiler in tuple(_PROFILERS):
+            profiler._record_stage(self.name, seconds)
+
+
+def is_profiling() -> bool:
+    return bool(_PROFILERS)
+
+
+def stage(name: str):
+    """ a context manager timing a stage, a shared no-op if no profiler is active """
+    if _PROFILERS:
+        return _StageTimer(name)
+    return _NULL_STAGE
+
+
+def count(name: str, n: int = 1):
+    """ add `n` to a counter of all active profilers """
+    if _PROFILERS:
+        for profiler in tuple(_PROFILERS):
+            profiler._record_count(name, n)
+
+
+def profiled(name: str):
+    """ decorator timing each call of a function as a stage """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _PROFILERS:
+                return func(*args, **kwargs)
+            with _StageTimer(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def loguru_hook(level: str = "DEBUG") -> Hook:
+    """ a hook forwarding every record to loguru """
+    from loguru import logger
+
+    def hook(kind: str, name: str, value: float):
+        logger.log(level, f"{kind} {name}: {value}")
+
+    return hook
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+from concurrent.futures import Executor
+
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from ord_diff.base import MessageType, DiffBackend, MatchingStrategy
+from ord_diff.budget import DiffBudget
+from ord_diff.cache import DiffCache
+from ord_diff.schema import MDictDiff, MDictListDiff
+from ord_diff.utils import flat_list_of_lists
+
+if TYPE_CHECKING:
+    from ord_schema import reaction_pb2
+
+REACTION_PART_MATCHING = {
+    MessageType.COMPOUND: MatchingStrategy.ASSIGNMENT,
+    MessageType.REACTION_WORKUP: MatchingStrategy.ALIGNMENT,
+    MessageType.REACTION_OUTCOME: MatchingStrategy.ASSIGNMENT,
+}
+""" how the message lists of a reaction are matched, workups are ordered steps """
+
+
+def input_compounds(r: reaction_pb2.Reaction) -> list[reaction_pb2.Compound]:
+    """ compounds of all inputs, input keys are labels that differ between sources so they are not used """
+    # `message_helpers` pulls in rdkit, it is only loaded when reactions are compared
+    from ord_schema import reaction_pb2
+    from ord_schema.message_helpers import find_submessages
+
+    compound_list, _ = flat_list_of_lists([find_submessages(ri, reaction_pb2.Compound) for ri in r.inputs.values()])
+    return compound_list
+
+
+def _diff_list(m1_list: list, m2_list: list, message_type: MessageType, **kwargs) -> MDictListDiff | None:
+    if not m1_list or not m2_list:
+        return None
+    return MDictListDiff.from_message_list_pair(
+        m1_list, m2_list, message_type, matching=REACTION_PART_MATCHING[message_type], **kwargs
+    )
+
+
+def _diff_message(m1, m2, message_type: MessageType, **kwargs) -> MDictDiff:
+    return MDictDiff.from_message_pair(m1, m2, message_type, **kwargs)
+
+
+class ReactionDiff(BaseModel):
+    """
+    base model for a comparison between two reactions, the reactions are decomposed into
+    input compounds, conditions, workups and outcomes which are compared independently
+    """
+
+    inputs: MDictListDiff | None
+    """ comparison of the compounds of all inputs, None if either reaction has no input compound """
+
+    conditions: MDictDiff
+    """ comparison of the reaction conditions """
+
+    workups: MDictListDiff | None
+    """ comparison of the workups, matched in order, None if either reaction has no workup """
+
+    outcomes: MDictListDiff | None
+    """ comparison of the outcomes, None if either reaction has no outcome """
+
+    @property
+    def parts(self) -> dict[MessageType, MDictListDiff | MDictDiff | None]:
+        """ message type -> comparison """
+        return {
+            MessageType.COMPOUND: self.inputs,
+            MessageType.REACTION_CONDITIONS: self.conditions,
+            MessageType.REACTION_WORKUP: self.workups,
+            MessageType.REACTION_OUTCOME: self.outcomes,
+        }
+
+    @property
+    def is_approximate(self) -> bool:
+        return any(part.is_approximate for part in self.parts.values() if part is not None)
+
+    @classmethod
+    def from_reaction_pair(
+            cls,
+            r1: reaction_pb2.Reaction,
+            r2: reaction_pb2.Reaction,
+            executor: Executor | None = None,
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            budget: DiffBudget | None = None,
+    ):
+        """
+        compare two reactions part by part
+
+        :param r1: the first reaction
+        :param r2: the second reaction
+        :param executor: if given, parts are compared concurrently on this thread/process pool,
+            otherwise one after another
+        :param cache: see `MDictListDiff.from_md_list_pair`, it is only shared if parts run in this process
+        :param backend: the diff engine
+        :param budget: limits of each part, see `DiffBudget`
+        """
+        kwargs = dict(cache=cache, backend=backend, budget=budget)
+        tasks = {
+            "inputs": (_diff_list, input_compounds(r1), input_compounds(r2), MessageType.COMPOUND),
+            "conditions": (_diff_message, r1.conditions, r2.conditions, MessageType.REACTION_CONDITIONS),
+            "workups": (_diff_list, list(r1.workups), list(r2.workups), MessageType.REACTION_WORKUP),
+            "outcomes": (_diff_list, list(r1.outcomes), list(r2.outcomes), MessageType.REACTION_OUTCOME),
+        }
+        if executor is None:
+            parts = {name: func(*args, **kwargs) for name, (func, *args) in tasks.items()}
+        else:
+            futures = {name: executor.submit(func, *args, **kwargs) for name, (func, *args) in tasks.items()}
+            parts = {name: future.result() for name, future in futures.items()}
+        return cls.model_construct(**parts)
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from concurrent.futures import Executor
+
+from ord_diff.base import MessageType
+from ord_diff.schema import MDict, MDictListDiff
+from ord_diff.text import TextIndex
+
+
+class PreparedReference:
+    """
+    a list of reference messages converted and indexed once, then compared with many candidate lists,
+    e.g. the outputs of several extraction models for the same reaction
+    """
+
+    def __init__(self, md_list: list[MDict]):
+        """ :param md_list: the reference messages, see `from_messages` """
+        assert len(md_list)
+        assert len(set(md.type for md in md_list)) == 1
+        self.md_list = md_list
+        self.message_type = md_list[0].type
+        for md in md_list:
+            # fill the caches used by matching and comparisons
+            md.content_hash(ignore_order=True)
+            md.content_hash(ignore_order=False)
+            md.identity_key
+            md.rough_length
+            md.table.index
+
+    @classmethod
+    def from_messages(cls, messages: list, message_type: MessageType, text: str | TextIndex | None = None):
+        """
+        :param messages: the reference messages
+        :param message_type: type of the messages
+        :param text: the source text of the reference, or its index, see `MDict.from_dict`
+        """
+        text_index = TextIndex.of(text)
+        return cls([MDict.from_message(m, message_type, text_index) for m in messages])
+
+    def diff(self, candidate_messages: list, candidate_text: str | TextIndex | None = None, **kwargs):
+        """
+        compare the reference with a list of candidate messages
+
+        :param candidate_messages: the candidate messages
+        :param candidate_text: the source text of the candidate, or its index
+        :param kwargs: other parameters of `MDictListDiff.from_md_list_pair`, e.g. `cache` or `backend`
+        :return: the comparison, None if there is no candidate message
+        """
+        if not candidate_messages:
+            return None
+        text_index = TextIndex.of(candidate_text)
+        md2_list = [MDict.from_message(m, self.message_type, text_index) for m in candidate_messages]
+        return MDictListDiff.from_md_list_pair(self.md_list, md2_list, **kwargs)
+
+    def diff_many(
+            self,
+            candidates: dict[str, list],
+            candidate_texts: dict[str, str | TextIndex] | None = None,
+            executor: Executor | None = None,
+            **kwargs
+    ) -> dict[str, MDictListDiff | None]:
+        """
+        compare the reference with many lists of candidate messages
+
+        :param candidates: candidate name -> candidate messages
+        :param candidate_texts: candidate name -> source text, candidates not included have no text
+        :param executor: if given, candidates are compared concurrently on this thread/process pool
+        :param kwargs: see `diff`
+        :return: candidate name -> comparison, in the order of `candidates`
+        """
+        candidate_texts = dict() if candidate_texts is None else candidate_texts
+        if executor is None:
+            return {
+                name: self.diff(messages, candidate_texts.get(name), **kwargs) for name, messages in candidates.items()
+            }
+        futures = {
+            name: executor.submit(self.diff, list(messages), candidate_texts.get(name), **kwargs)
+            for name, messages in candidates.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
@@ -1,60 +1,96 @@
 from __future__ import annotations
 
-import pandas as pd
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
 
 from ord_diff.base import CompoundLeafType, DeltaType
+from ord_diff.profiling import profiled
 from ord_diff.schema import MDict, MDictListDiff, MDictDiff, MessageType, Leaf
 from ord_diff.utils import flat_list_of_lists
 
+if TYPE_CHECKING:
+    # pandas is only loaded when a report is built
+    import pandas as pd
+
+    from ord_diff.reaction import ReactionDiff
+
+
+REPORT_COLUMNS = ["from", "path", "change_type", "is_explicit", "is_approximate"]
+""" columns of `report_diff`, compound reports also have `leaf_type` """
+
+REACTION_REPORT_COLUMNS = REPORT_COLUMNS + ["leaf_type", "pair_index", "message_type"]
+""" columns of `report_reaction_diff`, `leaf_type` is only set for compounds """
+
 
 def get_compound_leaf_type(leaf: Leaf):
+    return _get_compound_leaf_type(leaf.path_list)
+
+
+def _get_compound_leaf_type(path: Iterable[str | int]) -> CompoundLeafType:
     for ck in list(CompoundLeafType):
         if ck == CompoundLeafType.other:
             continue
-        if ck in leaf.path_list:
+        if ck in path:
             return CompoundLeafType(ck)
     return CompoundLeafType.other
 
 
 def get_compound_leaf_type_counter(cd: MDict):
     counter = {clt: 0 for clt in list(CompoundLeafType) + [None, ]}
-    for leaf in cd.leafs:
-        counter[get_compound_leaf_type(leaf)] += 1
+    for path in cd.table.paths:
+        counter[_get_compound_leaf_type(path)] += 1
     return counter
 
 
+def diff_rows(diff: MDictDiff) -> tuple[list[tuple[str | int, ...]], list[DeltaType | None], list[bool | None], int]:
+    """
+    rows of the report of a comparison, one per leaf of m1 and per added leaf of m2, leafs are classified in one pass
+    using the hashed views of `MDictDiff.delta_leaf_paths`, rows are read from the leaf tables
+    so no `Leaf` model is created
+
+    :return: path tuples, change types, explicit flags, number of rows from m1 (which come first)
+    """
+    delta_leaf_paths = diff.delta_leaf_paths
+    removed = delta_leaf_paths[DeltaType.REMOVAL]
+    altered = delta_leaf_paths[DeltaType.ALTERATION]
+    added = delta_leaf_paths[DeltaType.ADDITION]
+
+    table1 = diff.md1.table
+    table2 = diff.md2.table
+    rows2 = [i for i, path_tuple in enumerate(table2.paths) if path_tuple in added]
+    paths = table1.paths + [table2.paths[i] for i in rows2]
+
+    change_types = []
+    for path_tuple in table1.paths:
+        if path_tuple in removed:
+            change_types.append(DeltaType.REMOVAL)
+        elif path_tuple in altered:
+            change_types.append(DeltaType.ALTERATION)
+        else:
+            change_types.append(None)
+    change_types += [DeltaType.ADDITION] * len(rows2)
+    is_explicit = table1.is_explicit + [table2.is_explicit[i] for i in rows2]
+    return paths, change_types, is_explicit, len(table1)
+
+
+@profiled("report")
 def report_diff(
         diff: MDictDiff, message_type: MessageType = None
 ):
-    records = []
-    for leaf in diff.md1.leafs:
-        if leaf in diff.delta_leafs[DeltaType.REMOVAL]:
-            ct = DeltaType.REMOVAL
-        elif leaf in diff.delta_leafs[DeltaType.ALTERATION]:
-            ct = DeltaType.ALTERATION
-        else:
-            ct = None
-        record = {
-            "from": "m1",
-            "path": ".".join([str(p) for p in leaf.path_list]),
-            "change_type": ct,
-            "is_explicit": leaf.is_explicit,
-        }
-        if message_type == MessageType.COMPOUND:
-            record['leaf_type'] = get_compound_leaf_type(leaf)
-        records.append(record)
-    for leaf in diff.md2.leafs:
-        if leaf in diff.delta_leafs[DeltaType.ADDITION]:
-            record = {
-                "from": "m2",
-                "path": ".".join([str(p) for p in leaf.path_list]),
-                "change_type": DeltaType.ADDITION,
-                "is_explicit": leaf.is_explicit,
-            }
-            if message_type == MessageType.COMPOUND:
-                record['leaf_type'] = get_compound_leaf_type(leaf)
-            records.append(record)
-    return pd.DataFrame.from_records(records)
+    """ one row per leaf of m1 and per added leaf of m2, see `diff_rows` """
+    import pandas as pd
+
+    paths, change_types, is_explicit, n_rows1 = diff_rows(diff)
+    columns = {
+        "from": ["m1"] * n_rows1 + ["m2"] * (len(paths) - n_rows1),
+        "path": [".".join([str(p) for p in path_tuple]) for path_tuple in paths],
+        "change_type": change_types,
+        "is_explicit": is_explicit,
+        "is_approximate": [diff.is_approximate] * len(paths),
+    }
+    if message_type == MessageType.COMPOUND:
+        columns['leaf_type'] = [_get_compound_leaf_type(path_tuple) for path_tuple in paths]
+    return pd.DataFrame(columns)
 
 
 def report_diff_list(
@@ -66,13 +102,58 @@ def report_diff_list(
         message_type: MessageType,
 ):
     # compound_list_diff = MDictListDiff.from_message_list_pair(input1, input2, MessageType.COMPOUND, text1, text2)
+    import pandas as pd
+
     dfs = []
     for i, diff in enumerate(compound_list_diff.pair_comparisons):
         if diff is None:
             continue
         df = report_diff(diff, message_type=message_type)
         df['pair_index'] = i
+        df['is_approximate'] |= compound_list_diff.is_approximate
+        dfs.append(df)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def report_reaction_diff(reaction_diff: ReactionDiff) -> pd.DataFrame:
+    """ the reports of all parts of a reaction comparison, parts are labeled by `message_type` """
+    import pandas as pd
+
+    dfs = []
+    for message_type, part in reaction_diff.parts.items():
+        if part is None:
+            continue
+        if isinstance(part, MDictDiff):
+            df = report_diff(part, message_type=message_type)
+            df['pair_index'] = 0
+        elif any(pc is not None for pc in part.pair_comparisons):
+            df = report_diff_list(part, message_type=message_type)
+        else:
+            continue
+        df['message_type'] = message_type
+        dfs.append(df)
+    if not dfs:
+        return pd.DataFrame(columns=REACTION_REPORT_COLUMNS)
+    return pd.concat(dfs, ignore_index=True)
+
+
+def report_candidates(candidate_diffs: dict[str, MDictListDiff | None], message_type: MessageType) -> pd.DataFrame:
+    """
+    the reports of the comparisons between one reference and many candidates, stacked and labeled by `candidate`,
+    see `PreparedReference.diff_many`
+    """
+    import pandas as pd
+
+    dfs = []
+    for name, list_diff in candidate_diffs.items():
+        if list_diff is None or all(pc is None for pc in list_diff.pair_comparisons):
+            continue
+        df = report_diff_list(list_diff, message_type=message_type)
+        df['candidate'] = name
         dfs.append(df)
+    if not dfs:
+        columns = REPORT_COLUMNS + (["leaf_type"] if message_type == MessageType.COMPOUND else [])
+        return pd.DataFrame(columns=columns + ["pair_index", "candidate"])
     return pd.concat(dfs, ignore_index=True)
 
 
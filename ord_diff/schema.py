@@ -1,17 +1,28 @@
 from __future__ import annotations
 
+from collections.abc import Iterable, Callable
+
 import numpy as np
 from deepdiff import DeepDiff
-from google.protobuf import json_format
-from ord_schema import reaction_pb2
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr, computed_field
+
+from ord_diff.base import MessageType, DeltaType, DiffBackend, IdentityKernel, MatchingStrategy
+from ord_diff.budget import DiffBudget, BudgetTracker
+from ord_diff.cache import DiffCache
+from ord_diff.native import NativeDiffer, rough_length
+from ord_diff.prefilter import candidate_mask, DISTANCE_UPPER_BOUND
+from ord_diff.profiling import stage, count, profiled
+from ord_diff.text import TextIndex
+from ord_diff.utils import parse_deepdiff, flatten_columns, intern_path, find_best_match, DeepDiffKey, ParsedDiff, \
+    flat_diff, find_greedy_match, identity_distance_matrix, find_alignment_match, subtree_digests, prune_identical
 
-from ord_diff.base import MessageType, DeltaType
-from ord_diff.utils import parse_deepdiff, flatten, find_best_match
 
+_TRIE_LEAF = object()
+""" key of a leaf in a path trie, cannot collide with keys/indices in a path """
 
 # TODO for `Reaction.workups`, the order in the repeated field DOES matter,
 #  so using `ignore_order` in deepdiff seems fishy.
+#  `MatchingStrategy.ALIGNMENT` matches workup lists in order, pairs are still compared with `ignore_order`.
 
 class Leaf(BaseModel):
     """ base model for a literal field """
@@ -40,8 +51,140 @@ class Leaf(BaseModel):
         validate_assignment = True
 
 
+class LeafTable:
+    """
+    column-wise storage of the leafs of a message used by the hot paths,
+    `Leaf` models are only created when they are accessed
+    """
+
+    __slots__ = ("paths", "values", "is_explicit", "_index", "_trie", "_leafs")
+
+    def __init__(
+            self,
+            paths: list[tuple[str | int, ...]],
+            values: list[str | int | float],
+            is_explicit: list[bool | None],
+    ):
+        self.paths = paths
+        """ interned path tuples """
+
+        self.values = values
+        """ literal values """
+
+        self.is_explicit = is_explicit
+        """ see `Leaf.is_explicit` """
+
+        self._index = None
+        self._trie = None
+        self._leafs = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getstate__(self):
+        return self.paths, self.values, self.is_explicit
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    @classmethod
+    def from_dict(cls, d: dict, text_input: str | TextIndex | None = None):
+        """ from a nested dictionary, flattened into columns, see `utils.flatten_columns` """
+        with stage("flatten"):
+            paths, values = flatten_columns(d)
+        return cls._from_columns(paths, values, text_input)
+
+    @classmethod
+    def from_flat(cls, flat: dict[tuple[str | int, ...], str | int | float], text_input: str | TextIndex | None = None):
+        """ from a flattened dictionary, see `utils.flatten` """
+        return cls._from_columns([intern_path(p) for p in flat], list(flat.values()), text_input)
+
+    @classmethod
+    def _from_columns(cls, paths: list[tuple[str | int, ...]], values: list, text_input: str | TextIndex | None = None):
+        text_index = TextIndex.of(text_input)
+        if text_index is not None:
+            with stage("explicit_mask"):
+                is_explicit = text_index.explicit_mask(values)
+        else:
+            is_explicit = [None] * len(values)
+        return cls(paths, values, is_explicit)
+
+    @classmethod
+    def from_leafs(cls, leafs: Iterable[Leaf | dict]):
+        """ from `Leaf` models or their dumps """
+        with stage("leaf_validation"):
+            leafs = [leaf if isinstance(leaf, Leaf) else Leaf.model_validate(leaf) for leaf in leafs]
+        table = cls(
+            [intern_path(leaf.path_tuple) for leaf in leafs],
+            [leaf.value for leaf in leafs],
+            [leaf.is_explicit for leaf in leafs],
+        )
+        table._leafs = leafs
+        return table
+
+    @property
+    def index(self) -> dict[tuple[str | int, ...], int]:
+        """ path tuple -> row, the first row is used for repeated paths """
+        if self._index is None:
+            index = dict()
+            for i, p in enumerate(self.paths):
+                index.setdefault(p, i)
+            self._index = index
+        return self._index
+
+    @property
+    def trie(self) -> dict:
+        """ a trie of path tuples, rows are stored under `_TRIE_LEAF` """
+        if self._trie is None:
+            trie = dict()
+            for path_tuple, i in self.index.items():
+                node = trie
+                for p in path_tuple:
+                    node = node.setdefault(p, dict())
+                node[_TRIE_LEAF] = i
+            self._trie = trie
+        return self._trie
+
+    def leaf(self, i: int) -> Leaf:
+        """ the `Leaf` model of a row, created once """
+        if self._leafs is None:
+            self._leafs = [None] * len(self)
+        leaf = self._leafs[i]
+        if leaf is None:
+            leaf = Leaf.model_construct(
+                path_list=list(self.paths[i]), value=self.values[i], is_explicit=self.is_explicit[i]
+            )
+            self._leafs[i] = leaf
+        return leaf
+
+    def to_leafs(self) -> list[Leaf]:
+        return [self.leaf(i) for i in range(len(self))]
+
+    def rows_under(self, path_prefix: tuple[str | int, ...] | list[str | int]) -> list[int]:
+        """ rows whose paths start with `path_prefix` """
+        node = self.trie
+        for p in path_prefix:
+            try:
+                node = node[p]
+            except KeyError:
+                return []
+        rows = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for k, v in reversed(node.items()):
+                if k is _TRIE_LEAF:
+                    rows.append(v)
+                else:
+                    stack.append(v)
+        return rows
+
+
 class MDict(BaseModel):
-    """ base model for a message dictionary """
+    """
+    base model for a message dictionary, leafs are stored in a `LeafTable`
+    and exposed as `Leaf` models through `leafs`
+    """
 
     type: MessageType
     """ predefined type of the message """
@@ -49,50 +192,157 @@ class MDict(BaseModel):
     d: dict
     """ the actual dictionary """
 
-    leafs: list[Leaf]
-    """ all leafs of this message """
+    _table: LeafTable | None = PrivateAttr(default=None)
+
+    _subtree_digests: dict[bool, dict[tuple[str | int, ...], bytes]] = PrivateAttr(default_factory=dict)
+
+    _rough_length: int | None = PrivateAttr(default=None)
+
+    _type_checks: dict[MessageType, bool] = PrivateAttr(default_factory=dict)
+
+    _identity_key: tuple[str | None] | None = PrivateAttr(default=None)
+
+    def __init__(self, leafs: list[Leaf] | LeafTable | None = None, **data):
+        """ :param leafs: all leafs of this message, flattened from `d` if not given """
+        super().__init__(**data)
+        if leafs is None:
+            self._table = LeafTable.from_dict(self.d)
+        elif isinstance(leafs, LeafTable):
+            self._table = leafs
+        else:
+            self._table = LeafTable.from_leafs(leafs)
+
+    @classmethod
+    def from_table(cls, table: LeafTable, d: dict, message_type: MessageType):
+        """ construct without validation, `d` and `table` are trusted """
+        md = cls.model_construct(type=message_type, d=d)
+        md._table = table
+        return md
+
+    @property
+    def table(self) -> LeafTable:
+        return self._table
+
+    @computed_field
+    @property
+    def leafs(self) -> tuple[Leaf, ...]:
+        """
+        all leafs of this message, created from the leaf table on access so editing them does not change the message,
+        assign `leafs` to replace them
+        """
+        return tuple(self._table.to_leafs())
+
+    @leafs.setter
+    def leafs(self, leafs: Iterable[Leaf]):
+        self._table = LeafTable.from_leafs(leafs)
+
+    @property
+    def n_leafs(self) -> int:
+        return len(self._table)
+
+    def subtree_digests(self, ignore_order: bool = True) -> dict[tuple[str | int, ...], bytes]:
+        """ Merkle digests of `d` and its dict-nested subtrees, computed once, see `utils.subtree_digests` """
+        try:
+            return self._subtree_digests[ignore_order]
+        except KeyError:
+            digests = subtree_digests(self.d, ignore_order)
+            self._subtree_digests[ignore_order] = digests
+            return digests
+
+    def content_hash(self, ignore_order: bool = True) -> str:
+        """ canonical hash of `d`, same as `utils.content_hash` """
+        return self.subtree_digests(ignore_order)[()].hex()
+
+    @property
+    def rough_length(self) -> int:
+        """ size of `d` as used by deep distances, see `native.rough_length` """
+        if self._rough_length is None:
+            self._rough_length = rough_length(self.d)
+        return self._rough_length
 
     def is_type(self, message_type: MessageType):
-        """ type checker """
+        """ type checker, the protobuf parse is done once per message type """
+        try:
+            return self._type_checks[message_type]
+        except KeyError:
+            pass
+        from google.protobuf import json_format
+        from ord_schema import reaction_pb2
+
         if message_type == MessageType.COMPOUND:
             mt = reaction_pb2.Compound
         elif message_type == MessageType.REACTION_WORKUP:
             mt = reaction_pb2.ReactionWorkup
+        elif message_type == MessageType.REACTION_CONDITIONS:
+            mt = reaction_pb2.ReactionConditions
+        elif message_type == MessageType.REACTION_OUTCOME:
+            mt = reaction_pb2.ReactionOutcome
+        elif message_type == MessageType.REACTION:
+            mt = reaction_pb2.Reaction
         else:
             raise TypeError
         try:
             json_format.ParseDict(self.d, mt())
-            return True
+            is_type = True
         except TypeError:
-            return False
+            is_type = False
+        self._type_checks[message_type] = is_type
+        return is_type
+
+    @property
+    def identity_key(self) -> str | None:
+        """
+        the key used to tell if two messages describe the same thing, e.g. the compound name,
+        extracted once with the extractor registered for `type`, see `IDENTITY_KEY_EXTRACTORS`
+        """
+        if self._identity_key is None:
+            try:
+                extractor = IDENTITY_KEY_EXTRACTORS[self.type]
+            except KeyError:
+                key = None
+            else:
+                key = extractor(self)
+            self._identity_key = (key,)
+        return self._identity_key[0]
+
+    @property
+    def flat(self) -> dict[tuple[str | int, ...], str | int | float]:
+        """ path tuple -> leaf value """
+        return dict(zip(self._table.paths, self._table.values))
 
     def get_leaf(self, path: tuple[str | int, ...] | list[str | int]):
         """ access leaf directly """
-        path_tuple = tuple([*path])
-        for leaf in self.leafs:
-            if path_tuple == leaf.path_tuple:
-                return leaf
-        raise KeyError
+        return self._table.leaf(self._table.index[tuple(path)])
+
+    def get_leafs(self, paths: Iterable[tuple[str | int, ...] | list[str | int]]) -> list[Leaf]:
+        """ access leafs in bulk """
+        table = self._table
+        index = table.index
+        return [table.leaf(index[tuple(path)]) for path in paths]
+
+    def leafs_under(self, path_prefix: tuple[str | int, ...] | list[str | int]) -> list[Leaf]:
+        """ all leafs whose paths start with `path_prefix`, an empty prefix gives all leafs """
+        return [self._table.leaf(i) for i in self._table.rows_under(path_prefix)]
 
     @classmethod
-    def from_dict(cls, message_dictionary: dict, message_type: MessageType, text_input: str | None = None):
-        """ get message from a nested dictionary """
-        leafs = []
-        for path_tuple, value in flatten(message_dictionary).items():
-            if text_input:
-                if value in text_input:
-                    explicit = True
-                else:
-                    explicit = False
-            else:
-                explicit = None
-            leaf = Leaf(path_list=list(path_tuple), value=value, is_explicit=explicit)
-            leafs.append(leaf)
-        return cls(leafs=leafs, d=message_dictionary, type=message_type)
+    def from_dict(
+            cls, message_dictionary: dict, message_type: MessageType, text_input: str | TextIndex | None = None
+    ):
+        """
+        get message from a nested dictionary
+
+        :param text_input: the source text, or its index, to tell if leafs are explicitly mentioned,
+            pass a `TextIndex` to reuse it for many messages from the same text
+        """
+        table = LeafTable.from_dict(message_dictionary, text_input)
+        return cls.from_table(table, message_dictionary, message_type)
 
     @classmethod
-    def from_message(cls, m, message_type: MessageType, text_input: str | None = None):
-        d = json_format.MessageToDict(m)
+    def from_message(cls, m, message_type: MessageType, text_input: str | TextIndex | None = None):
+        from google.protobuf import json_format
+
+        with stage("message_to_dict"):
+            d = json_format.MessageToDict(m)
         return MDict.from_dict(d, message_type, text_input)
 
     @property
@@ -113,6 +363,18 @@ class MDict(BaseModel):
             raise ValueError('failed to access the `type` field of a ReactionWorkup')
 
 
+IDENTITY_KEY_EXTRACTORS: dict[MessageType, Callable[[MDict], str | None]] = {
+    MessageType.COMPOUND: lambda md: md.compound_name,
+    MessageType.REACTION_WORKUP: lambda md: md.workup_type,
+}
+""" message type -> function giving the identity key of a `MDict`, message types not included have no key """
+
+
+def register_identity_key(message_type: MessageType, extractor: Callable[[MDict], str | None]):
+    """ set the identity key extractor of a message type, only affects messages whose key has not been extracted """
+    IDENTITY_KEY_EXTRACTORS[message_type] = extractor
+
+
 class MDictDiff(BaseModel):
     """ base model for a comparison """
 
@@ -122,14 +384,6 @@ class MDictDiff(BaseModel):
     md2: MDict
     """ second message """
 
-    delta_leafs: dict[DeltaType, list[Leaf]]
-    """
-    a dictionary showing how leafs are changed, unchanged leafs are not included
-    ADDITION -> added leafs from m2
-    REMOVAL -> removed leafs from m1
-    ALTERATION -> altered leafs from m1
-    """
-
     delta_paths: dict[DeltaType, list[tuple[str | int, ...]]]
     """
     similar to `delta_leafs`, except the values here are paths to a generic field (may not be a leaf)
@@ -138,48 +392,212 @@ class MDictDiff(BaseModel):
     deep_distance: float
     """ deep distance between m1 and m2 """
 
+    is_approximate: bool = False
+    """ if the comparison exceeded its budget and a cheaper method was used, see `DiffBudget` """
+
+    _delta_leaf_path_lists: dict[DeltaType, list[tuple[str | int, ...]]] = PrivateAttr(default_factory=dict)
+
+    _delta_leafs: dict[DeltaType, list[Leaf]] | None = PrivateAttr(default=None)
+
+    _delta_leaf_paths: dict[DeltaType, frozenset[tuple[str | int, ...]]] | None = PrivateAttr(default=None)
+
     class Config:
         validate_assignment = True
         arbitrary_types_allowed = True
 
+    def __init__(self, delta_leafs: dict[DeltaType, list[Leaf]] | None = None, **data):
+        """
+        :param delta_leafs: see `delta_leafs`
+        """
+        super().__init__(**data)
+        if delta_leafs is not None:
+            self.delta_leafs = delta_leafs
+
     @classmethod
-    def from_md_pair(cls, md1: MDict, md2: MDict):
-        dd = DeepDiff(
-            md1.d, md2.d,
-            ignore_order=True, verbose_level=2, view='tree', get_deep_distance=True
+    def from_delta_leaf_paths(
+            cls, delta_leaf_path_lists: dict[DeltaType, list[tuple[str | int, ...]]], **data
+    ) -> MDictDiff:
+        """ construct without validation, `delta_leafs` are looked up from `md1`/`md2` when accessed """
+        diff = cls.model_construct(**data)
+        diff._delta_leaf_path_lists = delta_leaf_path_lists
+        return diff
+
+    @computed_field
+    @property
+    def delta_leafs(self) -> dict[DeltaType, list[Leaf]]:
+        """
+        a dictionary showing how leafs are changed, unchanged leafs are not included
+        ADDITION -> added leafs from m2
+        REMOVAL -> removed leafs from m1
+        ALTERATION -> altered leafs from m1
+        """
+        if self._delta_leafs is None:
+            self._delta_leafs = {
+                dt: (self.md2 if dt == DeltaType.ADDITION else self.md1).get_leafs(paths)
+                for dt, paths in self._delta_leaf_path_lists.items()
+            }
+        return self._delta_leafs
+
+    @delta_leafs.setter
+    def delta_leafs(self, delta_leafs: dict[DeltaType, list[Leaf]]):
+        delta_leafs = {
+            DeltaType(dt): [leaf if isinstance(leaf, Leaf) else Leaf.model_validate(leaf) for leaf in leafs]
+            for dt, leafs in delta_leafs.items()
+        }
+        self._delta_leafs = delta_leafs
+        self._delta_leaf_path_lists = {dt: [leaf.path_tuple for leaf in leafs] for dt, leafs in delta_leafs.items()}
+        self._delta_leaf_paths = None
+
+    @property
+    def delta_leaf_paths(self) -> dict[DeltaType, frozenset[tuple[str | int, ...]]]:
+        """ path tuples of `delta_leafs` as sets for O(1) membership tests """
+        if self._delta_leaf_paths is None:
+            self._delta_leaf_paths = {
+                dt: frozenset(self._delta_leaf_path_lists.get(dt, [])) for dt in DeltaType
+            }
+        return self._delta_leaf_paths
+
+    @staticmethod
+    def deepdiff(md1: MDict, md2: MDict, prune: bool = False, **kwargs) -> DeepDiff:
+        """
+        the (tree view) deepdiff between two messages, its deep distance is also used for matching
+
+        :param prune: if subtrees identical in both messages are left out, see `engine_inputs`,
+            use `full_deep_distance` to get the deep distance of the messages
+        :param kwargs: other parameters of `DeepDiff`, e.g. `max_passes`
+        """
+        if prune:
+            t1, t2 = MDictDiff.engine_inputs(md1, md2, DiffBackend.DEEPDIFF)
+        else:
+            t1, t2 = md1.d, md2.d
+        return DeepDiff(
+            t1, t2,
+            ignore_order=True, verbose_level=2, view='tree', get_deep_distance=True, **kwargs
         )
 
+    @staticmethod
+    def is_identical(md1: MDict, md2: MDict, backend: DiffBackend = DiffBackend.DEEPDIFF) -> bool:
+        """ if the backend would find no difference, by content hashes, order-insensitive only for deepdiff """
+        ignore_order = backend == DiffBackend.DEEPDIFF
+        return md1.content_hash(ignore_order) == md2.content_hash(ignore_order)
+
+    @staticmethod
+    def engine_inputs(md1: MDict, md2: MDict, backend: DiffBackend = DiffBackend.DEEPDIFF) -> tuple[dict, dict]:
+        """
+        the dictionaries sent to the diff engine, subtrees identical in both messages are pruned by
+        their Merkle digests, keys are kept so paths of the diff are paths of the messages
+        """
+        ignore_order = backend == DiffBackend.DEEPDIFF
+        return prune_identical(md1.d, md2.d, md1.subtree_digests(ignore_order), md2.subtree_digests(ignore_order))
+
+    @staticmethod
+    def full_deep_distance(distance: float, t1: dict, t2: dict, md1: MDict, md2: MDict) -> float:
+        """
+        the deep distance between two messages from the deep distance between their pruned dictionaries,
+        i.e. (number of operations) / (rough length of t1 + rough length of t2), only the denominator changes
+        """
+        if distance == 0 or (t1 is md1.d and t2 is md2.d):
+            return distance
+        n_ops = round(distance * (rough_length(t1) + rough_length(t2)))
+        return n_ops / (md1.rough_length + md2.rough_length)
+
+    @classmethod
+    @profiled("md_pair")
+    def from_md_pair(
+            cls, md1: MDict, md2: MDict,
+            dd: DeepDiff | ParsedDiff | None = None,
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            budget: DiffBudget | BudgetTracker | None = None,
+    ):
+        """
+        compare two messages
+
+        :param md1: the first message
+        :param md2: the second message
+        :param dd: the result of `MDictDiff.deepdiff(md1, md2)`, or a parsed diff from `backend`, if already computed
+        :param cache: if given, look up/store the parsed diff and the deep distance
+        :param backend: the diff engine
+        :param budget: if given, pairs exceeding the budget are compared with the hash-only diff
+        """
+        tracker = BudgetTracker.of(budget)
+        is_approximate = False
+        parsed_diff = dd if isinstance(dd, ParsedDiff) else None
+        if dd is None and cache is not None:
+            parsed_diff = cache.get_diff(md1, md2, backend)
+        if parsed_diff is None:
+            if dd is None and MDictDiff.is_identical(md1, md2, backend):
+                count("md_pair.identical")
+                parsed_diff = ParsedDiff.identical()
+            elif dd is None and tracker is not None and not tracker.check_pair(md1, md2):
+                count("md_pair.approximate")
+                parsed_diff = flat_diff(md1.flat, md2.flat)
+                is_approximate = True
+            elif backend == DiffBackend.NATIVE:
+                t1, t2 = MDictDiff.engine_inputs(md1, md2, backend)
+                with stage("native_diff"):
+                    parsed_diff = NativeDiffer().diff(t1, t2)
+                parsed_diff = parsed_diff._replace(
+                    deep_distance=MDictDiff.full_deep_distance(parsed_diff.deep_distance, t1, t2, md1, md2)
+                )
+            else:
+                if dd is None:
+                    with stage("deepdiff"):
+                        dd = MDictDiff.deepdiff(
+                            md1, md2, prune=True, **(tracker.deepdiff_kwargs() if tracker else dict())
+                        )
+                if tracker is not None and not tracker.check_deepdiff(dd):
+                    is_approximate = True
+                with stage("parse_deepdiff"):
+                    parsed_diff = parse_deepdiff(dd)
+                parsed_diff = parsed_diff._replace(
+                    deep_distance=MDictDiff.full_deep_distance(parsed_diff.deep_distance, dd.t1, dd.t2, md1, md2)
+                )
+            if cache is not None and not is_approximate:
+                cache.set_diff(md1, md2, parsed_diff, backend)
+                cache.set_distance(md1, md2, parsed_diff.deep_distance, backend)
+
         (
             deep_distance,
             paths_added, paths_removed, paths_altered_1, paths_altered_2,
             leaf_paths_added, leaf_paths_removed, leaf_paths_altered_1, leaf_paths_altered_2,
-        ) = parse_deepdiff(dd)
+        ) = parsed_diff
 
-        delta_leafs = {
-            DeltaType.ADDITION: [md2.get_leaf(p) for p in leaf_paths_added],
-            DeltaType.REMOVAL: [md1.get_leaf(p) for p in leaf_paths_removed],
-            DeltaType.ALTERATION: [md1.get_leaf(p) for p in leaf_paths_altered_1],
+        delta_leaf_path_lists = {
+            DeltaType.ADDITION: [tuple(p) for p in leaf_paths_added],
+            DeltaType.REMOVAL: [tuple(p) for p in leaf_paths_removed],
+            DeltaType.ALTERATION: [tuple(p) for p in leaf_paths_altered_1],
         }
 
         delta_paths = {
-            DeltaType.ADDITION: paths_added,
-            DeltaType.REMOVAL: paths_removed,
-            DeltaType.ALTERATION: paths_altered_1
+            DeltaType.ADDITION: [tuple(p) for p in paths_added],
+            DeltaType.REMOVAL: [tuple(p) for p in paths_removed],
+            DeltaType.ALTERATION: [tuple(p) for p in paths_altered_1],
         }
 
-        return cls(
+        return cls.from_delta_leaf_paths(
+            delta_leaf_path_lists,
             md1=md1,
             md2=md2,
             deep_distance=deep_distance,
             delta_paths=delta_paths,
-            delta_leafs=delta_leafs,
+            is_approximate=is_approximate,
         )
 
     @classmethod
-    def from_message_pair(cls, m1, m2, message_type: MessageType, text1: str = None, text2: str = None):
+    def from_message_pair(
+            cls, m1, m2, message_type: MessageType,
+            text1: str | TextIndex | None = None, text2: str | TextIndex | None = None,
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            budget: DiffBudget | None = None,
+    ):
         return MDictDiff.from_md_pair(
             md1=MDict.from_message(m1, message_type, text1),
             md2=MDict.from_message(m2, message_type, text2),
+            cache=cache,
+            backend=backend,
+            budget=budget,
         )
 
 
@@ -200,6 +618,7 @@ class MDictListDiff(BaseModel):
     1. no repeating index, unless None
     2. size = md1_list
     3. minimize the sum of deep distance
+    4. if matched with `MatchingStrategy.ALIGNMENT`, matched md2 indices are increasing
     """
 
     pair_comparisons: list[MDictDiff | None]
@@ -211,6 +630,9 @@ class MDictListDiff(BaseModel):
     n_changed: int
     """ num of md pairs that have at least one field added/removed/changed """
 
+    is_approximate: bool = False
+    """ if the matching or any of the pair comparisons exceeded its budget, see `DiffBudget` """
+
     @property
     def n_md1(self):
         """ number of messages in the md1 list """
@@ -242,22 +664,45 @@ class MDictListDiff(BaseModel):
     @classmethod
     def from_message_list_pair(
             cls, m1_list, m2_list, message_type: MessageType,
-            m1_text: str = None, m2_text: str = None
+            m1_text: str | TextIndex | None = None, m2_text: str | TextIndex | None = None,
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            budget: DiffBudget | None = None,
+            identity_kernel: IdentityKernel = IdentityKernel.EXACT,
+            top_k: int | None = None,
+            matching: MatchingStrategy = MatchingStrategy.ASSIGNMENT,
     ):
+        # each text is indexed once for the whole list
+        m1_text = TextIndex.of(m1_text)
+        m2_text = TextIndex.of(m2_text)
         md1_list = [MDict.from_message(m, message_type, m1_text) for m in m1_list]
         md2_list = [MDict.from_message(m, message_type, m2_text) for m in m2_list]
-        return MDictListDiff.from_md_list_pair(md1_list, md2_list)
+        return MDictListDiff.from_md_list_pair(
+            md1_list, md2_list, cache=cache, backend=backend, budget=budget, identity_kernel=identity_kernel,
+            top_k=top_k, matching=matching,
+        )
 
     @classmethod
     def from_md_list_pair(
             cls,
             md1_list: list[MDict],
             md2_list: list[MDict],
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            budget: DiffBudget | BudgetTracker | None = None,
+            identity_kernel: IdentityKernel = IdentityKernel.EXACT,
+            top_k: int | None = None,
+            matching: MatchingStrategy = MatchingStrategy.ASSIGNMENT,
     ):
         """
         find the differences between two lists of compound messages
         1. each compound in ref_compounds is matched with one from act_compounds, matched with None if missing
         2. use deepdiff to inspect matched pairs
+
+        a `DiffCache` can be shared across calls to skip comparisons between messages seen before,
+        a `DiffBudget` bounds the whole comparison, the result is flagged with `is_approximate` if exceeded,
+        `identity_kernel` sets how identity keys are compared for matching, and `top_k` limits exact distances
+        to the most promising candidates of long lists, `matching` sets if the order of the lists matters
         """
         assert len(md1_list) and len(md2_list)
         assert len(set([md.type for md in md1_list])) == 1
@@ -265,7 +710,13 @@ class MDictListDiff(BaseModel):
         assert md1_list[0].type == md2_list[0].type
 
         message_type = md1_list[0].type
-        matched_i2s = MDictListDiff.get_index_match(md1_list, md2_list, message_type=message_type)
+        # diffs computed for the distance matrix are reused for the matched pairs
+        pair_cache = dict()
+        tracker = BudgetTracker.of(budget)
+        matched_i2s = MDictListDiff.get_index_match(
+            md1_list, md2_list, message_type=message_type, pair_cache=pair_cache, cache=cache, backend=backend,
+            budget=tracker, identity_kernel=identity_kernel, top_k=top_k, matching=matching,
+        )
 
         pair_comparisons = []
         n_changed = 0
@@ -275,60 +726,128 @@ class MDictListDiff(BaseModel):
                 pair_comparison = None
             else:
                 m2 = md2_list[j]
-                pair_comparison = MDictDiff.from_md_pair(m1, m2)
+                pair_comparison = MDictDiff.from_md_pair(
+                    m1, m2, dd=pair_cache.get((i, j)), cache=cache, backend=backend, budget=tracker
+                )
                 if pair_comparison.deep_distance > 0:
                     n_changed += 1
             pair_comparisons.append(pair_comparison)
 
-        return cls(
+        # members are built above, skip re-validating them
+        return cls.model_construct(
             md1_list=md1_list,
             md2_list=md2_list,
             pair_comparisons=pair_comparisons,
             n_changed=n_changed,
             index_match=matched_i2s,
+            is_approximate=(tracker is not None and tracker.is_approximate) or any(
+                pc.is_approximate for pc in pair_comparisons if pc is not None
+            ),
         )
 
     @staticmethod
-    def index_match_distance_matrix(m1_list: list[MDict], m2_list: list[MDict], message_type: MessageType):
+    @profiled("distance_matrix")
+    def index_match_distance_matrix(
+            m1_list: list[MDict], m2_list: list[MDict], message_type: MessageType,
+            pair_cache: dict[tuple[int, int], DeepDiff | ParsedDiff] | None = None,
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            budget: DiffBudget | BudgetTracker | None = None,
+            identity_kernel: IdentityKernel = IdentityKernel.EXACT,
+            top_k: int | None = None,
+    ):
+        """
+        the distance matrix used for matching, a weighted sum of the identity distance and the full deep distance,
+        the identity distance is computed from `MDict.identity_key`
+
+        :param m1_list:
+        :param m2_list:
+        :param message_type: the type of messages in both lists
+        :param pair_cache: if given, the diff of each pair is stored here with the key of (i1, i2),
+            a `DeepDiff` for the deepdiff backend or a `ParsedDiff` for the native backend
+        :param cache: if given, full deep distances are looked up/stored here, pairs found in the cache
+            are not added to `pair_cache`
+        :param backend: the diff engine
+        :param budget: if given, pairs exceeding the budget use the distance of the hash-only diff
+        :param identity_kernel: how identity keys are compared, see `utils.identity_distance_matrix`
+        :param top_k: if given, full deep distances are only computed for the top k candidates of each row and
+            column ranked by a cheap surrogate distance, other cells get an upper bound, see `prefilter.candidate_mask`
+        :return:
+        """
         assert len(m1_list) and len(m2_list)
+        tracker = BudgetTracker.of(budget)
 
         indices1 = [*range(len(m1_list))]
         indices2 = [*range(len(m2_list))]
 
-        dist_mat = np.zeros((len(indices1), len(indices2)))
+        # identity keys are extracted once per message and compared in bulk
+        id_mat = identity_distance_matrix(
+            [md.identity_key for md in m1_list], [md.identity_key for md in m2_list], kernel=identity_kernel
+        )
+
+        if top_k is None:
+            mask = None
+        else:
+            with stage("prefilter"):
+                mask = candidate_mask(m1_list, m2_list, id_mat, top_k)
+        count("distance_matrix.cells", len(indices1) * len(indices2))
+
+        full_mat = np.zeros((len(indices1), len(indices2)))
+        native_differ = NativeDiffer()
         for i1 in indices1:
             md1 = m1_list[i1]
-            if message_type == MessageType.COMPOUND:
-                md1_id = md1.compound_name
-            elif message_type == MessageType.REACTION_WORKUP:
-                md1_id = md1.workup_type
-            else:
-                md1_id = None
             for i2 in indices2:
-                assert isinstance(i2, int)
+                if mask is not None and not mask[i1][i2]:
+                    continue
                 md2 = m2_list[i2]
-                if message_type == MessageType.COMPOUND:
-                    md2_id = md2.compound_name
-                elif message_type == MessageType.REACTION_WORKUP:
-                    md2_id = md2.workup_type
-                else:
-                    md2_id = None
-                try:
-                    distance_id = DeepDiff(md1_id, md2_id, get_deep_distance=True).to_dict()['deep_distance']
-                except KeyError:
-                    distance_id = 0
-                try:
-                    distance_full = DeepDiff(
-                        md1.d, md2.d, get_deep_distance=True, ignore_order=True
-                    ).to_dict()['deep_distance']
-                except KeyError:
+                # identical pairs are found by hashes before the cache, which may not see the order of lists
+                distance_full = None
+                if MDictDiff.is_identical(md1, md2, backend):
                     distance_full = 0
-                distance = distance_id * 100 + distance_full  # large penalty for wrong names
-                dist_mat[i1][i2] = distance
-        return dist_mat
+                    if pair_cache is not None:
+                        pair_cache[(i1, i2)] = ParsedDiff.identical()
+                elif cache is not None:
+                    distance_full = cache.get_distance(md1, md2, backend)
+                if distance_full is None and tracker is not None and not tracker.check_pair(md1, md2):
+                    distance_full = flat_diff(md1.flat, md2.flat).deep_distance
+                elif distance_full is None:
+                    count("distance_matrix.engine_calls")
+                    if backend == DiffBackend.NATIVE:
+                        t1, t2 = MDictDiff.engine_inputs(md1, md2, backend)
+                        with stage("native_diff"):
+                            dd = native_differ.diff(t1, t2)
+                        dd = dd._replace(deep_distance=MDictDiff.full_deep_distance(dd.deep_distance, t1, t2, md1, md2))
+                        distance_full = dd.deep_distance
+                    else:
+                        with stage("deepdiff"):
+                            dd = MDictDiff.deepdiff(
+                                md1, md2, prune=True, **(tracker.deepdiff_kwargs() if tracker else dict())
+                            )
+                        distance_full = MDictDiff.full_deep_distance(
+                            dd.get(DeepDiffKey.deep_distance.value, 0), dd.t1, dd.t2, md1, md2
+                        )
+                    if pair_cache is not None:
+                        pair_cache[(i1, i2)] = dd
+                    # distances of deepdiff runs stopped early are not cached
+                    is_truncated = tracker is not None and isinstance(dd, DeepDiff) and not tracker.check_deepdiff(dd)
+                    if cache is not None and not is_truncated:
+                        cache.set_distance(md1, md2, distance_full, backend)
+                full_mat[i1][i2] = distance_full
+        if mask is not None and not mask.all():
+            full_mat[~mask] = max(DISTANCE_UPPER_BOUND, full_mat[mask].max())
+        return id_mat * 100 + full_mat  # large penalty for wrong names
 
     @staticmethod
-    def get_index_match(m1_list: list[MDict], m2_list: list[MDict], message_type: MessageType):
+    def get_index_match(
+            m1_list: list[MDict], m2_list: list[MDict], message_type: MessageType,
+            pair_cache: dict[tuple[int, int], DeepDiff | ParsedDiff] | None = None,
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            budget: DiffBudget | BudgetTracker | None = None,
+            identity_kernel: IdentityKernel = IdentityKernel.EXACT,
+            top_k: int | None = None,
+            matching: MatchingStrategy = MatchingStrategy.ASSIGNMENT,
+    ):
         """
         for each compound in m1, find the most similar one in m2 based on a weighted deep distance,
         use the full deep distance to break tie
@@ -336,15 +855,35 @@ class MDictListDiff(BaseModel):
         :param m1_list:
         :param m2_list:
         :param message_type:
+        :param pair_cache: see `index_match_distance_matrix`
+        :param cache: see `index_match_distance_matrix`
+        :param backend: see `index_match_distance_matrix`
+        :param budget: if given, lists longer than `DiffBudget.max_list_size` are matched greedily
+        :param identity_kernel: see `index_match_distance_matrix`
+        :param top_k: see `index_match_distance_matrix`
+        :param matching: `MatchingStrategy.ASSIGNMENT` ignores the order of the lists,
+            `MatchingStrategy.ALIGNMENT` preserves it and may leave messages of both lists unmatched
         :return:
         """
+        tracker = BudgetTracker.of(budget)
 
         indices1 = [*range(len(m1_list))]
         indices2 = [*range(len(m2_list))]
 
-        distance_matrix = MDictListDiff.index_match_distance_matrix(m1_list, m2_list, message_type)
+        distance_matrix = MDictListDiff.index_match_distance_matrix(
+            m1_list, m2_list, message_type, pair_cache=pair_cache, cache=cache, backend=backend, budget=tracker,
+            identity_kernel=identity_kernel, top_k=top_k,
+        )
+
+        count("matching.size", len(indices1) * len(indices2))
+        with stage("matching"):
+            if matching == MatchingStrategy.ALIGNMENT:
+                return find_alignment_match(indices1, indices2, distance_matrix)
 
-        while len(indices2) < len(indices1):
-            indices2.append(None)
+            while len(indices2) < len(indices1):
+                indices2.append(None)
 
-        return find_best_match(indices1, indices2, distance_matrix)
+            if tracker is not None and tracker.is_list_too_long(len(m1_list), len(m2_list)):
+                tracker.degrade("max_list_size")
+                return find_greedy_match(indices1, indices2, distance_matrix)
+            return find_best_match(indices1, indices2, distance_matrix)
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import numpy as np
+
+from ord_diff.base import DiffBackend, IdentityKernel, MatchingStrategy
+from ord_diff.cache import DiffCache
+from ord_diff.profiling import count, stage
+from ord_diff.schema import MDict, MDictDiff, MDictListDiff
+from ord_diff.text import TextIndex
+from ord_diff.utils import assignment_cost_matrix, solve_assignment, find_alignment_match
+
+
+class DiffSession:
+    """
+    a comparison between a fixed reference list and a candidate list that is edited between iterations,
+    e.g. in an extraction-refinement loop
+
+    each `update` only computes the distance matrix columns of candidate messages whose content changed,
+    columns of unchanged messages are moved along with them, and pair diffs of unchanged matched pairs are reused;
+    the assignment is re-solved from the previous one, i.e. the potentials and the assignment of unchanged columns
+    are kept and only rows matched to changed columns are augmented again
+    """
+
+    def __init__(
+            self,
+            md1_list: list[MDict],
+            md2_list: list[MDict],
+            cache: DiffCache | None = None,
+            backend: DiffBackend = DiffBackend.DEEPDIFF,
+            identity_kernel: IdentityKernel = IdentityKernel.EXACT,
+            matching: MatchingStrategy = MatchingStrategy.ASSIGNMENT,
+    ):
+        """
+        :param md1_list: the reference messages, fixed for the session
+        :param md2_list: the first version of the candidate messages
+        :param cache: see `MDictListDiff.from_md_list_pair`
+        :param backend: the diff engine
+        :param identity_kernel: see `MDictListDiff.index_match_distance_matrix`
+        :param matching: see `MDictListDiff.get_index_match`
+        """
+        assert len(md1_list)
+        assert len(set(md.type for md in md1_list)) == 1
+        self.md1_list = md1_list
+        self.message_type = md1_list[0].type
+        self.cache = cache
+        self.backend = backend
+        self.identity_kernel = identity_kernel
+        self.matching = matching
+
+        self.md2_list: list[MDict] = []
+        self.list_diff: MDictListDiff | None = None
+        """ the comparison with the current candidate list, None if it is empty """
+
+        self.n_recomputed_columns = 0
+        """ number of distance matrix columns computed by the last update """
+
+        self._hashes2: list[str] = []
+        self._distance_matrix = np.zeros((len(md1_list), 0))
+        # (i1, order-sensitive content hash of md2) -> diff from the distance matrix, or the pair comparison
+        self._engine_diffs = dict()
+        self._pair_diffs: dict[tuple[int, str], MDictDiff] = dict()
+        # row_to_col, u, v of the last square assignment
+        self._assignment: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+        self.update(md2_list)
+
+    @classmethod
+    def from_message_list_pair(
+            cls, m1_list, m2_list, message_type,
+            m1_text: str | TextIndex | None = None, m2_text: str | TextIndex | None = None, **kwargs
+    ):
+        m1_text = TextIndex.of(m1_text)
+        m2_text = TextIndex.of(m2_text)
+        md1_list = [MDict.from_message(m, message_type, m1_text) for m in m1_list]
+        md2_list = [MDict.from_message(m, message_type, m2_text) for m in m2_list]
+        return cls(md1_list, md2_list, **kwargs)
+
+    def update_messages(self, m2_list, m2_text: str | TextIndex | None = None) -> MDictListDiff | None:
+        """ `update` from candidate messages """
+        m2_text = TextIndex.of(m2_text)
+        return self.update([MDict.from_message(m, self.message_type, m2_text) for m in m2_list])
+
+    def patch(self, changes: dict[int, MDict]) -> MDictListDiff | None:
+        """ `update` with the candidate messages at some positions replaced """
+        md2_list = list(self.md2_list)
+        for j, md2 in changes.items():
+            md2_list[j] = md2
+        return self.update(md2_list)
+
+    def update(self, md2_list: list[MDict]) -> MDictListDiff | None:
+        """
+        compare the reference with a new version of the candidate list
+
+        :param md2_list: the new candidate messages, messages may be edited, added, removed or reordered
+        :return: the comparison, same as `MDictListDiff.from_md_list_pair(md1_list, md2_list)` up to ties
+        """
+        assert all(md.type == self.message_type for md in md2_list)
+        ignore_order = self.backend == DiffBackend.DEEPDIFF
+        hashes2 = [md.content_hash(ignore_order) for md in md2_list]
+        old_columns = dict()
+        for j, h in enumerate(self._hashes2):
+            old_columns.setdefault(h, j)
+        # new column -> old column with the same content, None if it has to be computed
+        column_map = [old_columns.get(h) for h in hashes2]
+
+        with stage("session.distance_matrix"):
+            distance_matrix = self._update_distance_matrix(md2_list, column_map)
+        count("session.recomputed_columns", self.n_recomputed_columns)
+
+        self.md2_list = md2_list
+        self._hashes2 = hashes2
+        self._distance_matrix = distance_matrix
+        # diffs of messages no longer in the candidate list are dropped
+        current = set(md.content_hash(False) for md in md2_list)
+        self._engine_diffs = {k: dd for k, dd in self._engine_diffs.items() if k[1] in current}
+        self._pair_diffs = {k: diff for k, diff in self._pair_diffs.items() if k[1] in current}
+
+        if not md2_list:
+            self._assignment = None
+            self.list_diff = None
+            return None
+
+        with stage("session.matching"):
+            matched_i2s = self._match(column_map)
+        self.list_diff = self._build_list_diff(matched_i2s)
+        return self.list_diff
+
+    def _update_distance_matrix(self, md2_list: list[MDict], column_map: list[int | None]) -> np.ndarray:
+        n1 = len(self.md1_list)
+        distance_matrix = np.zeros((n1, len(md2_list)))
+        kept = [j for j, o in enumerate(column_map) if o is not None]
+        changed = [j for j, o in enumerate(column_map) if o is None]
+        if kept:
+            distance_matrix[:, kept] = self._distance_matrix[:, [column_map[j] for j in kept]]
+        self.n_recomputed_columns = len(changed)
+        if changed:
+            pair_cache = dict()
+            distance_matrix[:, changed] = MDictListDiff.index_match_distance_matrix(
+                self.md1_list, [md2_list[j] for j in changed], self.message_type, pair_cache=pair_cache,
+                cache=self.cache, backend=self.backend, identity_kernel=self.identity_kernel,
+            )
+            for (i1, k), dd in pair_cache.items():
+                self._engine_diffs[(i1, md2_list[changed[k]].content_hash(False))] = dd
+        return distance_matrix
+
+    def _match(self, column_map: list[int | None]) -> dict[int, int | None]:
+        n1 = len(self.md1_list)
+        n2 = len(column_map)
+        indices1 = [*range(n1)]
+        indices2 = [*range(n2)]
+        if self.matching == MatchingStrategy.ALIGNMENT:
+            self._assignment = None
+            return find_alignment_match(indices1, indices2, self._distance_matrix)
+
+        while len(indices2) < len(indices1):
+            indices2.append(None)
+        cost = assignment_cost_matrix(indices1, indices2, self._distance_matrix)
+        n = cost.shape[0]
+        if self._assignment is None or len(self._assignment[0]) != n:
+            # the square matrix changed its size, the previous rows are not the current rows
+            row_to_col, u, v = solve_assignment(cost)
+        else:
+            row_to_col, u, v = solve_assignment(cost, *self._warm_start(cost, column_map))
+        self._assignment = row_to_col, u, v
+        return {i1: indices2[row_to_col[i1]] for i1 in indices1}
+
+    def _warm_start(self, cost: np.ndarray, column_map: list[int | None]):
+        """
+        potentials and a partial assignment for the new cost matrix that are dual feasible and tight,
+        kept columns have the same costs so their potentials and assigned rows are carried over,
+        other columns (changed or dummy) get the largest feasible potential and start unassigned
+        """
+        old_row_to_col, u, old_v = self._assignment
+        n = cost.shape[0]
+        old_to_new = {o: j for j, o in enumerate(column_map) if o is not None}
+        v = np.empty(n)
+        is_kept = np.zeros(n, dtype=bool)
+        for j in range(n):
+            o = column_map[j] if j < len(column_map) else None
+            if o is None:
+                v[j] = np.min(cost[:, j] - u)
+            else:
+                v[j] = old_v[o]
+                is_kept[j] = True
+        row_to_col = np.full(n, -1, dtype=int)
+        for i, o in enumerate(old_row_to_col):
+            j = old_to_new.get(int(o))
+            if j is not None and is_kept[j]:
+                row_to_col[i] = j
+        return u.copy(), v, row_to_col
+
+    def _build_list_diff(self, matched_i2s: dict[int, int | None]) -> MDictListDiff:
+        pair_comparisons = []
+        n_changed = 0
+        for i, md1 in enumerate(self.md1_list):
+            j = matched_i2s[i]
+            if j is None:
+                pair_comparisons.append(None)
+                continue
+            md2 = self.md2_list[j]
+            key = (i, md2.content_hash(False))
+            pair_comparison = self._pair_diffs.get(key)
+            if pair_comparison is None:
+                pair_comparison = MDictDiff.from_md_pair(
+                    md1, md2, dd=self._engine_diffs.get(key), cache=self.cache, backend=self.backend
+                )
+                self._pair_diffs[key] = pair_comparison
+            elif pair_comparison.md2 is not md2:
+                # same content, the new message may have another source text, so its leafs are looked up again
+                pair_comparison = MDictDiff.from_delta_leaf_paths(
+                    pair_comparison._delta_leaf_path_lists,
+                    md1=md1, md2=md2, delta_paths=pair_comparison.delta_paths,
+                    deep_distance=pair_comparison.deep_distance, is_approximate=pair_comparison.is_approximate,
+                )
+                self._pair_diffs[key] = pair_comparison
+            if pair_comparison.deep_distance > 0:
+                n_changed += 1
+            pair_comparisons.append(pair_comparison)
+        return MDictListDiff.model_construct(
+            md1_list=self.md1_list,
+            md2_list=self.md2_list,
+            pair_comparisons=pair_comparisons,
+            n_changed=n_changed,
+            index_match=matched_i2s,
+            is_approximate=False,
+        )
@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import array
+import json
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from ord_diff.base import DeltaType, MessageType
+from ord_diff.report import diff_rows, _get_compound_leaf_type
+from ord_diff.schema import MDictDiff, MDictListDiff
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+FORMAT_VERSION = 1
+
+META_FILE = "meta.json"
+""" the path table and the list keys, written last so a store without it is incomplete """
+
+CHANGE_TYPE_CODES = {None: -1, DeltaType.ADDITION: 0, DeltaType.REMOVAL: 1, DeltaType.ALTERATION: 2}
+
+EXPLICIT_CODES = {None: -1, False: 0, True: 1}
+
+MESSAGE_TYPE_CODES = {mt: i for i, mt in enumerate(MessageType)}
+
+SCHEMA: dict[str, dict[str, str]] = {
+    "records": {"diff": "i", "from": "b", "path": "i", "change_type": "b", "is_explicit": "b"},
+    "diffs": {
+        "list": "i", "pair_index": "i", "match_index": "i", "message_type": "b", "deep_distance": "d",
+        "is_approximate": "B", "record_start": "q", "record_stop": "q",
+    },
+    "lists": {
+        "n1": "i", "n2": "i", "n_changed": "i", "is_approximate": "B", "match_start": "q", "match_stop": "q",
+        "diff_start": "i", "diff_stop": "i",
+    },
+    "matches": {"list": "i", "index1": "i", "index2": "i"},
+}
+"""
+table -> column -> `array` typecode, each column is stored as `<table>.<column>.npy`
+
+- records: one per report row, see `report.diff_rows`, `from` is 0 for m1 and 1 for m2, `path` indexes the path table,
+  `change_type` and `is_explicit` are coded by `CHANGE_TYPE_CODES` and `EXPLICIT_CODES`
+- diffs: one per `MDictDiff`, its records are `records[record_start:record_stop]`, `list` is -1 for a diff
+  not from a list, `pair_index`/`match_index` are the indices of the messages in their lists
+- lists: one per `MDictListDiff`, its index match is `matches[match_start:match_stop]`,
+  its pair comparisons are `diffs[diff_start:diff_stop]`
+- matches: (index in md1_list, index in md2_list or -1) of the index matches
+"""
+
+
+class DiffStoreWriter:
+    """
+    write comparisons to a folder of numpy columns, all tables are buffered as packed arrays and written on `close`,
+    so the whole store is held in memory until then, write one store per part of a larger run
+
+        with DiffStoreWriter("diffs/") as writer:
+            for rid, list_diff in results:
+                writer.add_list_diff(list_diff, MessageType.COMPOUND, key=rid)
+    """
+
+    def __init__(self, directory: str | os.PathLike):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._path_ids: dict[tuple[str | int, ...], int] = dict()
+        self._keys: list[str] = []
+        self._columns = {
+            table: {column: array.array(typecode) for column, typecode in columns.items()}
+            for table, columns in SCHEMA.items()
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+
+    def add_diff(
+            self, diff: MDictDiff, message_type: MessageType,
+            list_id: int = -1, pair_index: int = 0, match_index: int = 0, is_approximate: bool = False,
+    ) -> int:
+        """
+        add a comparison of two messages
+
+        :param diff: the comparison
+        :param message_type: type of the messages
+        :param list_id: the list it belongs to, see `add_list_diff`
+        :param pair_index: index of md1 in its list
+        :param match_index: index of md2 in its list
+        :param is_approximate: if the comparison of the list is approximate
+        :return: the diff id
+        """
+        records = self._columns["records"]
+        diffs = self._columns["diffs"]
+        diff_id = len(diffs["list"])
+        record_start = len(records["diff"])
+
+        paths, change_types, is_explicit, n_rows1 = diff_rows(diff)
+        path_ids = self._path_ids
+        records["diff"].extend([diff_id] * len(paths))
+        records["from"].extend([0] * n_rows1 + [1] * (len(paths) - n_rows1))
+        records["path"].extend([path_ids.setdefault(p, len(path_ids)) for p in paths])
+        records["change_type"].extend([CHANGE_TYPE_CODES[ct] for ct in change_types])
+        records["is_explicit"].extend([EXPLICIT_CODES[e] for e in is_explicit])
+
+        diffs["list"].append(list_id)
+        diffs["pair_index"].append(pair_index)
+        diffs["match_index"].append(match_index)
+        diffs["message_type"].append(MESSAGE_TYPE_CODES[message_type])
+        diffs["deep_distance"].append(diff.deep_distance)
+        diffs["is_approximate"].append(diff.is_approximate or is_approximate)
+        diffs["record_start"].append(record_start)
+        diffs["record_stop"].append(len(records["diff"]))
+        return diff_id
+
+    def add_list_diff(self, list_diff: MDictListDiff, message_type: MessageType, key: str = "") -> int:
+        """
+        add a comparison of two message lists, its pair comparisons are added with `add_diff`
+
+        :param list_diff: the comparison
+        :param message_type: type of the messages
+        :param key: a label of the list, e.g. the reaction id
+        :return: the list id
+        """
+        lists = self._columns["lists"]
+        matches = self._columns["matches"]
+        list_id = len(self._keys)
+        self._keys.append(key)
+
+        match_start = len(matches["list"])
+        for i1, i2 in sorted(list_diff.index_match.items()):
+            matches["list"].append(list_id)
+            matches["index1"].append(i1)
+            matches["index2"].append(-1 if i2 is None else i2)
+        lists["n1"].append(len(list_diff.md1_list))
+        lists["n2"].append(len(list_diff.md2_list))
+        lists["n_changed"].append(list_diff.n_changed)
+        lists["is_approximate"].append(list_diff.is_approximate)
+        lists["match_start"].append(match_start)
+        lists["match_stop"].append(len(matches["list"]))
+
+        lists["diff_start"].append(len(self._columns["diffs"]["list"]))
+        for i, diff in enumerate(list_diff.pair_comparisons):
+            if diff is None:
+                continue
+            self.add_diff(
+                diff, message_type, list_id=list_id, pair_index=i, match_index=list_diff.index_match[i],
+                is_approximate=list_diff.is_approximate,
+            )
+        lists["diff_stop"].append(len(self._columns["diffs"]["list"]))
+        return list_id
+
+    def close(self):
+        """ write the columns, then the meta file """
+        for table, columns in self._columns.items():
+            for column, values in columns.items():
+                path = os.path.join(self.directory, f"{table}.{column}.npy")
+                values = np.frombuffer(values, dtype=values.typecode) if len(values) else np.array([], values.typecode)
+                if SCHEMA[table][column] == "B":
+                    values = values.astype(bool)
+                np.save(path, values)
+        meta = {
+            "version": FORMAT_VERSION,
+            "paths": [list(p) for p in self._path_ids],
+            "keys": self._keys,
+        }
+        tmp_path = os.path.join(self.directory, f"{META_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(self.directory, META_FILE))
+
+
+class DiffStore:
+    """
+    comparisons written by `DiffStoreWriter`, columns are memory mapped so only the rows queried are read,
+    e.g. `store.records["change_type"]` is a read-only array of all leaf-level change records
+    """
+
+    def __init__(self, directory: str | os.PathLike, mmap: bool = True):
+        """
+        :param directory: the folder written by `DiffStoreWriter`
+        :param mmap: if columns are memory mapped, otherwise they are loaded
+        """
+        with open(os.path.join(directory, META_FILE), "r") as f:
+            meta = json.load(f)
+        assert meta["version"] == FORMAT_VERSION, f"unsupported store version: {meta['version']}"
+        self.directory = directory
+        self.paths: list[tuple[str | int, ...]] = [tuple(p) for p in meta["paths"]]
+        """ path id -> path tuple """
+        self.keys: list[str] = meta["keys"]
+        """ list id -> key """
+        mmap_mode = "r" if mmap else None
+        for table, columns in SCHEMA.items():
+            setattr(self, table, {
+                column: np.load(os.path.join(directory, f"{table}.{column}.npy"), mmap_mode=mmap_mode)
+                for column in columns
+            })
+
+    @property
+    def n_records(self) -> int:
+        return len(self.records["diff"])
+
+    @property
+    def n_diffs(self) -> int:
+        return len(self.diffs["list"])
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.keys)
+
+    def diff_records(self, diff_id: int) -> dict[str, np.ndarray]:
+        """ the records of a comparison """
+        start, stop = self.diffs["record_start"][diff_id], self.diffs["record_stop"][diff_id]
+        return {column: values[start:stop] for column, values in self.records.items()}
+
+    def list_diff_ids(self, list_id: int) -> np.ndarray:
+        """ ids of the pair comparisons of a list, in the order of md1 """
+        return np.arange(self.lists["diff_start"][list_id], self.lists["diff_stop"][list_id])
+
+    def index_match(self, list_id: int) -> dict[int, int | None]:
+        """ the index match of a list, see `MDictListDiff.index_match` """
+        start, stop = self.lists["match_start"][list_id], self.lists["match_stop"][list_id]
+        return {
+            int(i1): None if i2 < 0 else int(i2)
+            for i1, i2 in zip(self.matches["index1"][start:stop], self.matches["index2"][start:stop])
+        }
+
+    def path_ids(self, prefix: tuple[str | int, ...]) -> np.ndarray:
+        """ ids of the paths starting with a prefix, e.g. ("amount", ) """
+        return np.array([i for i, p in enumerate(self.paths) if p[:len(prefix)] == prefix], dtype=np.int32)
+
+    def change_counts(self) -> dict[DeltaType, np.ndarray]:
+        """ change type -> number of records of each path id """
+        paths = self.records["path"]
+        change_type_codes = self.records["change_type"]
+        return {
+            change_type: np.bincount(paths[change_type_codes == code], minlength=len(self.paths))
+            for change_type, code in CHANGE_TYPE_CODES.items() if change_type is not None
+        }
+
+    def to_frame(self, diff_ids: list[int] | np.ndarray | None = None) -> pd.DataFrame:
+        """
+        the records of some comparisons (default to all) in the columns of `report.report_diff_list`,
+        labeled by `key` and `message_type`, `leaf_type` is None for messages other than compounds
+        """
+        import pandas as pd
+
+        if diff_ids is None:
+            diff_ids = np.arange(self.n_diffs)
+        starts = self.diffs["record_start"][diff_ids]
+        stops = self.diffs["record_stop"][diff_ids]
+        rows = np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)]) if len(diff_ids) else np.array([], int)
+        diff_of_row = self.records["diff"][rows]
+
+        change_types = np.array(list(CHANGE_TYPE_CODES), dtype=object)
+        explicit_flags = np.array(list(EXPLICIT_CODES), dtype=object)
+        message_types = np.array(list(MESSAGE_TYPE_CODES), dtype=object)
+        path_strings = np.array([".".join([str(p) for p in path_tuple]) for path_tuple in self.paths], dtype=object)
+        leaf_types = np.array([_get_compound_leaf_type(path_tuple) for path_tuple in self.paths], dtype=object)
+        list_of_row = self.diffs["list"][diff_of_row]
+        keys = np.array(self.keys + [None], dtype=object)
+        path_of_row = self.records["path"][rows]
+        message_type_of_row = self.diffs["message_type"][diff_of_row]
+        is_compound = message_type_of_row == MESSAGE_TYPE_CODES[MessageType.COMPOUND]
+        return pd.DataFrame({
+            "from": np.where(self.records["from"][rows] == 0, "m1", "m2"),
+            "path": path_strings[path_of_row] if len(self.paths) else [],
+            "change_type": change_types[self.records["change_type"][rows] + 1],
+            "is_explicit": explicit_flags[self.records["is_explicit"][rows] + 1],
+            "is_approximate": self.diffs["is_approximate"][diff_of_row],
+            "leaf_type": np.where(is_compound, leaf_types[path_of_row], None) if len(self.paths) else [],
+            "pair_index": self.diffs["pair_index"][diff_of_row].astype(np.int64),
+            "key": keys[list_of_row],
+            "message_type": message_types[message_type_of_row],
+        })
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import re
+
+from pydantic import BaseModel
+
+_NUMBER_PATTERN = re.compile(r"(?<![\w.])[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+class TextNormalization(BaseModel):
+    """ how the source text and leaf values are normalized before looking up mentions """
+
+    case: bool = False
+    """ case-insensitive matching """
+
+    whitespace: bool = False
+    """ runs of whitespace are matched as one space """
+
+    numeric: bool = True
+    """
+    numeric values are looked up by value among the numbers in the text, e.g. 1.0 is mentioned by "1" or "1.00",
+    otherwise they are looked up as their string form
+    """
+
+    def normalize(self, s: str) -> str:
+        if self.whitespace:
+            s = _WHITESPACE_PATTERN.sub(" ", s).strip()
+        if self.case:
+            s = s.casefold()
+        return s
+
+
+class TextIndex:
+    """
+    an index of a source text built once and reused for all messages extracted from it,
+    it tells if leaf values are explicitly mentioned in the text, see `Leaf.is_explicit`
+    """
+
+    def __init__(self, text: str, normalization: TextNormalization | None = None):
+        """
+        :param text: the source text
+        :param normalization: how the text and the values are normalized, default to `TextNormalization()`
+        """
+        self.text = text
+        self.normalization = TextNormalization() if normalization is None else normalization
+        self._normalized_text = self.normalization.normalize(text)
+        self._numbers: set[float] | None = None
+        self._cache: dict[tuple[type, str | int | float], bool | None] = dict()
+
+    @property
+    def numbers(self) -> set[float]:
+        """ values of the numbers in the text, parsed on the first numeric lookup """
+        if self._numbers is None:
+            self._numbers = {float(m.group()) for m in _NUMBER_PATTERN.finditer(self._normalized_text)}
+        return self._numbers
+
+    @staticmethod
+    def of(text: str | TextIndex | None, normalization: TextNormalization | None = None) -> TextIndex | None:
+        """ index a text, or use an existing index, None and empty texts give None """
+        if text is None or isinstance(text, TextIndex):
+            return text
+        if not text:
+            return None
+        return TextIndex(text, normalization)
+
+    def is_explicit(self, value: str | int | float | bool | None) -> bool | None:
+        """ if a leaf value is mentioned in the text, None for values that cannot be mentioned (booleans and None) """
+        key = (type(value), value)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        if value is None or isinstance(value, bool):
+            explicit = None
+        elif isinstance(value, (int, float)) and self.normalization.numeric:
+            explicit = float(value) in self.numbers
+        else:
+            # a substring search of the normalized text, repeated values are answered by the memo
+            explicit = self.normalization.normalize(str(value)) in self._normalized_text
+        self._cache[key] = explicit
+        return explicit
+
+    def explicit_mask(self, values: list) -> list[bool | None]:
+        """ `is_explicit` of all leaf values of a message """
+        return [self.is_explicit(v) for v in values]
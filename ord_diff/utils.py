@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import difflib
+import hashlib
 import itertools
 import math
 from collections.abc import MutableMapping
 from enum import Enum
+from typing import NamedTuple
 
+import numpy as np
 from deepdiff import DeepDiff
 from deepdiff.helper import NotPresent
 from deepdiff.model import DiffLevel, PrettyOrderedSet, REPORT_KEYS
 
+from ord_diff.base import IdentityKernel
+
 
 class DeepDiffKey(str, Enum):
     values_changed = 'values_changed'
@@ -19,39 +25,99 @@ class DeepDiffKey(str, Enum):
     deep_distance = 'deep_distance'
 
 
+class ParsedDiff(NamedTuple):
+    """ leafs/paths that are added/removed/altered, see `parse_deepdiff` """
+
+    deep_distance: float
+    paths_added: list[list[str | int]]
+    paths_removed: list[list[str | int]]
+    paths_altered_1: list[list[str | int]]
+    paths_altered_2: list[list[str | int]]
+    leaf_paths_added: list[tuple[str | int, ...]]
+    leaf_paths_removed: list[tuple[str | int, ...]]
+    leaf_paths_altered_1: list[tuple[str | int, ...]]
+    leaf_paths_altered_2: list[tuple[str | int, ...]]
+
+    @classmethod
+    def identical(cls) -> ParsedDiff:
+        """ the diff between two identical messages """
+        return cls(0, [], [], [], [], [], [], [], [])
+
+
+PATH_POOL_SIZE = 65536
+""" max number of interned path tuples, the pool is cleared when it is full so long runs do not grow it forever """
+
+_PATH_POOL: dict[tuple[str | int, ...], tuple[str | int, ...]] = dict()
+""" interned path tuples, messages of the same type share most of their paths """
+
+
+def intern_path(path_tuple: tuple[str | int, ...]) -> tuple[str | int, ...]:
+    """ the shared instance of a path tuple, paths interned before the pool was last cleared are not shared """
+    try:
+        return _PATH_POOL[path_tuple]
+    except KeyError:
+        if len(_PATH_POOL) >= PATH_POOL_SIZE:
+            _PATH_POOL.clear()
+        _PATH_POOL[path_tuple] = path_tuple
+        return path_tuple
+
+
+def iter_flatten(obj: MutableMapping | list, prefix: tuple[str | int, ...] = ()):
+    """
+    non-recursive `flatten` yielding (path tuple, leaf value) in depth-first order,
+    an empty dict/list inside `obj` is a `None` leaf, an empty `obj` has no leaf
+
+    :param obj: a dictionary, or a list whose indices are used as keys
+    :param prefix: path of `obj`, prepended to all paths
+    """
+    stack = [(prefix, iter(obj.items()) if isinstance(obj, MutableMapping) else enumerate(obj))]
+    while stack:
+        path, children = stack[-1]
+        for key, value in children:
+            child_path = path + (key,)
+            if isinstance(value, MutableMapping):
+                if value:
+                    stack.append((child_path, iter(value.items())))
+                    break
+                yield child_path, None
+            elif isinstance(value, list):
+                if value:
+                    stack.append((child_path, enumerate(value)))
+                    break
+                yield child_path, None
+            else:
+                yield child_path, value
+        else:
+            stack.pop()
+
+
+def flatten_columns(
+        obj: MutableMapping | list, prefix: tuple[str | int, ...] = (), intern: bool = True
+) -> tuple[list[tuple[str | int, ...]], list]:
+    """
+    `flatten` as two columns, paths and values
+
+    :param intern: if paths are interned, see `intern_path`
+    """
+    paths = []
+    values = []
+    for path, value in iter_flatten(obj, prefix):
+        paths.append(intern_path(path) if intern else path)
+        values.append(value)
+    return paths, values
+
+
 def flatten(dictionary, parent_key=None):
     """
-    Taken from https://stackoverflow.com/a/62186294
     Turn a nested dictionary into a flattened dictionary
     Note if there is an integer in the path tuple, one cannot tell if it is a list index or a key,
     although usually integers are not used as keys in ord messages.
 
     :param dictionary: The dictionary to flatten
-    :param parent_key: Argument used in recursive
+    :param parent_key: path of the dictionary, prepended to all paths
     :return: A flattened dictionary where keys are `path tuples` to reach leafs
     """
-
-    items = []
-    for key, value in dictionary.items():
-        if parent_key:
-            new_key = list(parent_key) + [key, ]
-        else:
-            new_key = [key, ]
-        new_key = tuple(new_key)
-        if isinstance(value, MutableMapping):
-            if not value.items():
-                items.append((new_key, None))
-            else:
-                items.extend(flatten(value, new_key).items())
-        elif isinstance(value, list):
-            if len(value):
-                for k, v in enumerate(value):
-                    items.extend(flatten({k: v}, new_key).items())
-            else:
-                items.append((new_key, None))
-        else:
-            items.append((new_key, value))
-    return dict(items)
+    return dict(iter_flatten(dictionary, tuple(parent_key) if parent_key else ()))
 
 
 def flat_deepdiff_entry(t, path_list) -> dict[tuple[str | int, ...], str | int | float | None]:
@@ -64,13 +130,9 @@ def flat_deepdiff_entry(t, path_list) -> dict[tuple[str | int, ...], str | int |
     """
     path_tuple = tuple(path_list)
     if isinstance(t, dict):
-        t1 = flatten(t)
-        t1_from_root = {tuple(path_list + list(k)): v for k, v in t1.items()}
+        t1_from_root = dict(iter_flatten(t, path_tuple))
     elif isinstance(t, list):
-        dummy_header = "DUMMY" * 3
-        dummy_t = {dummy_header: t}
-        t1 = flatten(dummy_t)
-        t1_from_root = {tuple(path_list + list(k)[1:]): v for k, v in t1.items()}
+        t1_from_root = dict(iter_flatten(t, path_tuple)) if t else {path_tuple: None}
     elif isinstance(t, NotPresent):
         t1_from_root = {path_tuple: None}
     else:
@@ -78,6 +140,147 @@ def flat_deepdiff_entry(t, path_list) -> dict[tuple[str | int, ...], str | int |
     return t1_from_root
 
 
+def content_hash(obj, ignore_order: bool = True) -> str:
+    """
+    a canonical hash of a json-like object (nested dicts/lists of literals),
+    key order of dicts never matters, item order of lists only matters if `ignore_order` is False
+
+    literal types are part of the hash as deepdiff reports `1` vs `1.0` as a type change
+    """
+    return _content_digest(obj, ignore_order).hex()
+
+
+def _content_digest(obj, ignore_order: bool) -> bytes:
+    if isinstance(obj, MutableMapping):
+        items = sorted(
+            _content_digest(k, ignore_order) + _content_digest(v, ignore_order) for k, v in obj.items()
+        )
+        payload = b"d" + b"".join(items)
+    elif isinstance(obj, list):
+        items = [_content_digest(v, ignore_order) for v in obj]
+        if ignore_order:
+            items.sort()
+        payload = b"l" + b"".join(items)
+    else:
+        payload = f"{type(obj).__name__}:{obj!r}".encode()
+    return hashlib.blake2b(payload, digest_size=16).digest()
+
+
+def subtree_digests(obj, ignore_order: bool = True) -> dict[tuple[str | int, ...], bytes]:
+    """
+    Merkle digests of `obj` and of its subtrees reachable from the root through dicts only,
+    a dict digest is built from the digests of its values, the digest of the root () is the one of `content_hash`
+
+    :return: path tuple -> digest
+    """
+    digests = dict()
+
+    def visit(node, path):
+        if isinstance(node, MutableMapping):
+            items = sorted(_content_digest(k, ignore_order) + visit(v, path + (k,)) for k, v in node.items())
+            digest = hashlib.blake2b(b"d" + b"".join(items), digest_size=16).digest()
+        else:
+            digest = _content_digest(node, ignore_order)
+        digests[path] = digest
+        return digest
+
+    visit(obj, ())
+    return digests
+
+
+def prune_identical(
+        t1: dict, t2: dict,
+        digests1: dict[tuple[str | int, ...], bytes], digests2: dict[tuple[str | int, ...], bytes],
+        path: tuple[str | int, ...] = (),
+) -> tuple[dict, dict]:
+    """
+    copies of two dictionaries without the subtrees that are identical in both, see `subtree_digests`,
+    keys are kept so paths in a diff of the copies are the same as in a diff of the originals
+
+    :param t1: the first dictionary, its digests are `digests1`
+    :param t2: the second dictionary, its digests are `digests2`
+    :param path: path of `t1` and `t2` from the root
+    """
+    pruned1 = dict()
+    pruned2 = dict()
+    for k, v1 in t1.items():
+        if k not in t2:
+            pruned1[k] = v1
+            continue
+        v2 = t2[k]
+        p = path + (k,)
+        if digests1[p] == digests2[p]:
+            continue
+        if isinstance(v1, MutableMapping) and isinstance(v2, MutableMapping):
+            pruned1[k], pruned2[k] = prune_identical(v1, v2, digests1, digests2, p)
+        else:
+            pruned1[k] = v1
+            pruned2[k] = v2
+    for k, v2 in t2.items():
+        if k not in t1:
+            pruned2[k] = v2
+    return pruned1, pruned2
+
+
+def identity_distance(key1, key2) -> float:
+    """ the deep distance between two identity keys, 0 if they are equal """
+    try:
+        return DeepDiff(key1, key2, get_deep_distance=True).to_dict()['deep_distance']
+    except KeyError:
+        return 0
+
+
+def identity_distance_matrix(
+        keys1: list, keys2: list, kernel: IdentityKernel = IdentityKernel.EXACT
+) -> np.ndarray:
+    """
+    `identity_distance` for all pairs of keys, keys are factorized into integer codes so the distances
+    are computed once per pair of distinct keys and spread to the matrix by broadcasting
+
+    for string/None keys this gives the same values as `identity_distance` without running deepdiff:
+    two different strings are 0.5 apart, a string and None are 1.0 (None in `keys2`) or 1.5 (None in `keys1`),
+    other keys fall back to `identity_distance`
+
+    :param keys1: keys of the first list
+    :param keys2: keys of the second list
+    :param kernel: with `IdentityKernel.SIMILARITY`, different strings are 0.5 * (1 - similarity) apart,
+        where similarity is the `difflib.SequenceMatcher` ratio, so near-miss names are penalized less
+    :return: a len(keys1) x len(keys2) matrix
+    """
+    # keyed by type as well so 1, 1.0 and True are not merged
+    codes = dict()
+    codes1 = np.array([codes.setdefault((type(k), k), len(codes)) for k in keys1], dtype=int)
+    codes2 = np.array([codes.setdefault((type(k), k), len(codes)) for k in keys2], dtype=int)
+    unique_keys = [k for _, k in codes]
+
+    is_none = np.array([k is None for k in unique_keys])
+    is_str = np.array([isinstance(k, str) for k in unique_keys])
+    unique_codes = np.arange(len(unique_keys))
+    unique_distances = np.where(unique_codes[:, None] == unique_codes[None, :], 0.0, 0.5)
+    unique_distances[np.ix_(is_str, is_none)] = 1.0
+    unique_distances[np.ix_(is_none, is_str)] = 1.5
+
+    if kernel == IdentityKernel.SIMILARITY:
+        str_codes = unique_codes[is_str]
+        for c1 in np.unique(codes1):
+            if not is_str[c1]:
+                continue
+            matcher = difflib.SequenceMatcher(b=unique_keys[c1])
+            for c2 in str_codes:
+                if c2 != c1:
+                    matcher.set_seq1(unique_keys[c2])
+                    unique_distances[c1, c2] = 0.5 * (1 - matcher.ratio())
+
+    is_other = ~(is_none | is_str)
+    if is_other.any():
+        for c1 in np.unique(codes1):
+            for c2 in np.unique(codes2):
+                if c1 != c2 and (is_other[c1] or is_other[c2]):
+                    unique_distances[c1, c2] = identity_distance(unique_keys[c1], unique_keys[c2])
+
+    return unique_distances[codes1[:, None], codes2[None, :]]
+
+
 def get_dict_depth(d):
     """ get the max depth of a nested dict """
     if not isinstance(d, dict) or not d:
@@ -86,8 +289,114 @@ def get_dict_depth(d):
         return max(get_dict_depth(v) for k, v in d.items()) + 1
 
 
+def solve_assignment(
+        cost_matrix,
+        u: np.ndarray | None = None,
+        v: np.ndarray | None = None,
+        row_to_col: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    minimum-cost perfect matching for a *square* cost matrix,
+    Hungarian algorithm with potentials (shortest augmenting paths), O(n^3)
+
+    the inner loop over columns is vectorized with numpy, so a few hundred rows take well under a second
+
+    :param cost_matrix: a square matrix of finite costs
+    :param u: row potentials to start from, zeros if not given
+    :param v: column potentials to start from, zeros if not given
+    :param row_to_col: a partial assignment to start from (-1 for a free row),
+        it must be tight w.r.t. `u` and `v`, i.e. `cost[i, j] == u[i] + v[j]` for assigned pairs
+    :return: row_to_col, u, v
+    """
+    cost = np.asarray(cost_matrix, dtype=float)
+    n = cost.shape[0]
+    assert cost.shape == (n, n), "the cost matrix must be square"
+    u = np.zeros(n) if u is None else np.array(u, dtype=float)
+    v = np.zeros(n) if v is None else np.array(v, dtype=float)
+
+    col_to_row = np.full(n, -1, dtype=int)
+    if row_to_col is not None:
+        for i, j in enumerate(row_to_col):
+            if j >= 0:
+                col_to_row[j] = i
+
+    assigned_rows = set(col_to_row[col_to_row >= 0].tolist())
+    for i in range(n):
+        if i in assigned_rows:
+            continue
+        # `way[j]` is the previous column on the alternating path to column j, -1 means the free row `i`
+        minv = np.full(n, math.inf)
+        way = np.full(n, -1, dtype=int)
+        used = np.zeros(n, dtype=bool)
+        i0 = i
+        j0 = -1
+        while True:
+            if j0 >= 0:
+                used[j0] = True
+            free = ~used
+            reduced = cost[i0] - u[i0] - v
+            better = free & (reduced < minv)
+            minv[better] = reduced[better]
+            way[better] = j0
+            candidates = np.where(free, minv, math.inf)
+            j1 = int(np.argmin(candidates))
+            delta = candidates[j1]
+            u[i] += delta
+            u[col_to_row[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if col_to_row[j0] == -1:
+                break
+            i0 = col_to_row[j0]
+        # flip the alternating path
+        while True:
+            j_prev = way[j0]
+            if j_prev == -1:
+                col_to_row[j0] = i
+                break
+            col_to_row[j0] = col_to_row[j_prev]
+            j0 = j_prev
+
+    row_to_col = np.empty(n, dtype=int)
+    row_to_col[col_to_row] = np.arange(n)
+    return row_to_col, u, v
+
+
+def assignment_cost_matrix(indices1: list[int], indices2: list[int | None], distance_matrix) -> np.ndarray:
+    """
+    the square cost matrix used to match `indices1` to `indices2`,
+    a `None` in `indices2` is a dummy column of zero cost, missing rows are padded with zero-cost dummy rows
+    """
+    assert len(indices2) >= len(indices1), "`indices2` should be padded with `None` to the size of `indices1`"
+    distance_matrix = np.asarray(distance_matrix, dtype=float)
+    n = len(indices2)
+    cost = np.zeros((n, n))
+    real_cols = [k for k, i2 in enumerate(indices2) if i2 is not None]
+    if indices1 and real_cols:
+        cost[np.ix_(range(len(indices1)), real_cols)] = distance_matrix[
+            np.ix_(indices1, [indices2[k] for k in real_cols])
+        ]
+    return cost
+
+
 def find_best_match(indices1: list[int], indices2: list[int | None], distance_matrix):
-    """ given a distance matrix and two lists of indices, find the best index match """
+    """
+    given a distance matrix and two lists of indices, find the best index match,
+    i.e. the assignment minimizing the sum of distances, `None` in `indices2` means "no match"
+    """
+    if not indices1:
+        return dict()
+    cost = assignment_cost_matrix(indices1, indices2, distance_matrix)
+    row_to_col, _, _ = solve_assignment(cost)
+    return {i1: indices2[row_to_col[k]] for k, i1 in enumerate(indices1)}
+
+
+def find_best_match_brute_force(indices1: list[int], indices2: list[int | None], distance_matrix):
+    """
+    same as `find_best_match` but enumerates all permutations, O(n!),
+    only used as a reference for small inputs
+    """
     match_space = itertools.permutations(indices2, r=len(indices1))
     best_match_distance = math.inf
     best_match_solution = None
@@ -106,7 +415,95 @@ def find_best_match(indices1: list[int], indices2: list[int | None], distance_ma
     return dict(zip(indices1, [*best_match_solution]))
 
 
-def parse_deepdiff(dd: DeepDiff):
+def find_alignment_match(
+        indices1: list[int], indices2: list[int | None], distance_matrix, gap_cost: float = 50.0
+):
+    """
+    same contract as `find_best_match` but the match preserves the order of both lists,
+    it is a global sequence alignment (Needleman-Wunsch) in O(nm), substituting i1 with i2 costs
+    `distance_matrix[i1][i2]` and skipping an index of either list costs `gap_cost`
+
+    :param gap_cost: cost of leaving an index unmatched, pairs with a distance larger than 2 * `gap_cost`
+        are never matched, the default keeps pairs of different types (identity penalty 50) aligned
+    """
+    real_indices2 = [i2 for i2 in indices2 if i2 is not None]
+    n1 = len(indices1)
+    n2 = len(real_indices2)
+    score = np.zeros((n1 + 1, n2 + 1))
+    score[:, 0] = np.arange(n1 + 1) * gap_cost
+    score[0, :] = np.arange(n2 + 1) * gap_cost
+    for k1 in range(1, n1 + 1):
+        row = distance_matrix[indices1[k1 - 1]]
+        for k2 in range(1, n2 + 1):
+            score[k1, k2] = min(
+                score[k1 - 1, k2 - 1] + row[real_indices2[k2 - 1]],
+                score[k1 - 1, k2] + gap_cost,
+                score[k1, k2 - 1] + gap_cost,
+            )
+
+    match = {i1: None for i1 in indices1}
+    k1, k2 = n1, n2
+    while k1 > 0 and k2 > 0:
+        i1 = indices1[k1 - 1]
+        i2 = real_indices2[k2 - 1]
+        if score[k1, k2] == score[k1 - 1, k2 - 1] + distance_matrix[i1][i2]:
+            match[i1] = i2
+            k1 -= 1
+            k2 -= 1
+        elif score[k1, k2] == score[k1 - 1, k2] + gap_cost:
+            k1 -= 1
+        else:
+            k2 -= 1
+    return match
+
+
+def find_greedy_match(indices1: list[int], indices2: list[int | None], distance_matrix):
+    """
+    same contract as `find_best_match` but pairs the closest remaining indices first,
+    O(nm log nm), not optimal, used when lists are too long for the budget
+    """
+    real_indices2 = [i2 for i2 in indices2 if i2 is not None]
+    cells = sorted(
+        (distance_matrix[i1][i2], k1, k2)
+        for k1, i1 in enumerate(indices1) for k2, i2 in enumerate(real_indices2)
+    )
+    match = {i1: None for i1 in indices1}
+    used1 = set()
+    used2 = set()
+    for _, k1, k2 in cells:
+        if k1 in used1 or k2 in used2:
+            continue
+        match[indices1[k1]] = real_indices2[k2]
+        used1.add(k1)
+        used2.add(k2)
+    return match
+
+
+def flat_diff(flat1: dict[tuple, object], flat2: dict[tuple, object]) -> ParsedDiff:
+    """
+    hash-only diff between two flattened dictionaries (see `flatten`), leafs are compared by their paths,
+    so list items are compared by index; it is linear and used as the cheap fallback when a budget is exceeded
+
+    the distance is (number of changed leafs) / (number of leafs in 1 + number of leafs in 2)
+    """
+    leaf_paths_added = [p for p in flat2 if p not in flat1]
+    leaf_paths_removed = [p for p in flat1 if p not in flat2]
+    leaf_paths_altered = [
+        p for p, v in flat1.items() if p in flat2 and (type(v) is not type(flat2[p]) or v != flat2[p])
+    ]
+    n_ops = len(leaf_paths_added) + len(leaf_paths_removed) + len(leaf_paths_altered)
+    deep_distance = n_ops / (len(flat1) + len(flat2)) if n_ops else 0
+    return ParsedDiff(
+        deep_distance,
+        [list(p) for p in leaf_paths_added],
+        [list(p) for p in leaf_paths_removed],
+        [list(p) for p in leaf_paths_altered],
+        [list(p) for p in leaf_paths_altered],
+        leaf_paths_added, leaf_paths_removed, leaf_paths_altered, list(leaf_paths_altered),
+    )
+
+
+def parse_deepdiff(dd: DeepDiff) -> ParsedDiff:
     """
     given a deepdiff (tree view), return leafs that are added/removed/altered
     IMPORTANT: because we use ignore_order in deepdiff, for a change determined by deepdiff,
@@ -153,7 +550,7 @@ def parse_deepdiff(dd: DeepDiff):
                 leaf_paths_altered_2 += list(t2_leafs_from_root.keys())
             else:
                 raise ValueError
-    return (
+    return ParsedDiff(
         deep_distance,
         paths_added, paths_removed, paths_altered_1, paths_altered_2,
         leaf_paths_added, leaf_paths_removed, leaf_paths_altered_1, leaf_paths_altered_2
@@ -1,14 +1,78 @@
 import json
+import os
 import random
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import pandas as pd
 import pytest
 from deepdiff import DeepDiff
 from google.protobuf import json_format
-from ord_schema.message_helpers import find_submessages
-from ord_schema.proto import reaction_pb2
+from ord_schema.message_helpers import find_submessages, write_message
+from ord_schema.proto import dataset_pb2, reaction_pb2
 
-from ord_diff.report import report_diff, MDictDiff, MessageType, report_diff_list, MDictListDiff
-from ord_diff.utils import flatten, flat_deepdiff_entry, flat_list_of_lists
+from ord_diff.base import DeltaType, DiffBackend, IdentityKernel, MatchingStrategy
+from ord_diff.budget import DiffBudget
+from ord_diff.benchmark.generators import compound_list_pair, perturb, reaction_pair
+from ord_diff.benchmark.run import run_benchmarks, compare_results, measure_import
+from ord_diff.batch import diff_pairs, diff_reaction_pair, main as batch_main, stream_diff_pairs, iter_pairs, \
+    iter_dataset_pairs
+from ord_diff.cache import DiffCache
+from ord_diff.native import native_diff
+from ord_diff.profiling import Profiler, is_profiling
+from ord_diff.schema import IDENTITY_KEY_EXTRACTORS
+from ord_diff.text import TextIndex, TextNormalization
+from ord_diff.reaction import ReactionDiff
+from ord_diff.reference import PreparedReference
+from ord_diff.session import DiffSession
+from ord_diff.store import DiffStore, DiffStoreWriter
+from ord_diff.report import report_diff, MDictDiff, MessageType, report_diff_list, MDictListDiff, MDict, \
+    report_reaction_diff, report_candidates
+from ord_diff import utils
+from ord_diff.utils import flatten, iter_flatten, flatten_columns, flat_deepdiff_entry, flat_list_of_lists, \
+    find_best_match, find_best_match_brute_force, content_hash, find_greedy_match, identity_distance, identity_distance_matrix, \
+    find_alignment_match, parse_deepdiff, intern_path
+
+
+def make_compound(name: str, smiles: str = None, mass: float = None, role: str = None) -> reaction_pb2.Compound:
+    """ a small compound message for tests that do not need the sample reaction pairs """
+    c = reaction_pb2.Compound()
+    c.identifiers.add(type="NAME", value=name)
+    if smiles:
+        c.identifiers.add(type="SMILES", value=smiles)
+    if mass is not None:
+        c.amount.mass.value = mass
+        c.amount.mass.units = reaction_pb2.Mass.GRAM
+    if role:
+        c.reaction_role = reaction_pb2.ReactionRole.ReactionRoleType.Value(role)
+    return c
+
+
+def make_reaction(compounds: list[reaction_pb2.Compound], workup_types: list[str] = ()) -> reaction_pb2.Reaction:
+    """ a reaction with one input per compound """
+    r = reaction_pb2.Reaction()
+    for i, c in enumerate(compounds):
+        r.inputs[f"m{i}"].components.append(c)
+    for wt in workup_types:
+        r.workups.add(type=reaction_pb2.ReactionWorkup.ReactionWorkupType.Value(wt))
+    return r
+
+
+@pytest.fixture
+def synthetic_pairs():
+    """ pairs in the format of the pairs files: [rid, reaction 1 json, reaction 2 json] """
+    pairs = []
+    for i in range(6):
+        r1 = make_reaction(
+            [make_compound("water", "O", 1.0 + i, "SOLVENT"), make_compound("benzene", "c1ccccc1", 2.0, "REACTANT")],
+            ["WASH", "DRY_WITH_MATERIAL"],
+        )
+        r2 = make_reaction([make_compound("water", "O", 1.0, "SOLVENT")], ["WASH"])
+        pairs.append([f"rid_{i}", json_format.MessageToJson(r1), json_format.MessageToJson(r2)])
+    pairs.append(["rid_bad", "{}", "not a reaction"])
+    return pairs
 
 
 class TestUtils:
@@ -30,6 +94,20 @@ class TestUtils:
     def test_flatten(self, nested_dictionary1):
         flat = {(1, '2'): 5, ('lalala', 7, 0): 8, ('lalala', 7, 1, 9): 12, ('lalala', 'kkk'): '11'}
         assert flatten(nested_dictionary1) == flat
+        assert list(flatten(nested_dictionary1).items()) == list(iter_flatten(nested_dictionary1))
+        assert flatten({"a": {}, "b": [], "c": [[], {}]}) == {
+            ("a",): None, ("b",): None, ("c", 0): None, ("c", 1): None
+        }
+        assert flatten({"a": [1]}, ["p"]) == {("p", "a", 0): 1}
+        paths, values = flatten_columns(nested_dictionary1)
+        assert dict(zip(paths, values)) == flat
+        assert flatten_columns({1: {"2": 6}})[0][0] is paths[0]
+        utils._PATH_POOL.clear()
+        for i in range(utils.PATH_POOL_SIZE + 1):
+            intern_path(("x", i))
+        assert len(utils._PATH_POOL) == 1
+        assert flat_deepdiff_entry([], ["x"]) == {("x",): None}
+        assert flat_deepdiff_entry([{"a": 1}, 2], ["x"]) == {("x", 0, "a"): 1, ("x", 1): 2}
 
     def test_flat_deepdiff_entry(self, nested_dictionary1, nested_dictionary2):
         dd = DeepDiff(nested_dictionary1, nested_dictionary2, ignore_order=True, verbose_level=2, view="tree")
@@ -40,6 +118,37 @@ class TestUtils:
                 flat_deepdiff_entry(value_altered_level.t1, path_list_to_t1)
                 flat_deepdiff_entry(value_altered_level.t2, path_list_to_t2)
 
+    def test_content_hash(self, nested_dictionary1):
+        shuffled = {"lalala": {"kkk": "11", 7: [{9: 12}, 8]}, 1: {"2": 5}}
+        assert content_hash(nested_dictionary1) == content_hash(shuffled)
+        assert content_hash(nested_dictionary1, ignore_order=False) != content_hash(shuffled, ignore_order=False)
+        assert content_hash({"a": 1}) != content_hash({"a": 1.0})
+
+    def test_identity_distance_matrix(self):
+        keys1 = ["water", "benzene", None, "water", 1]
+        keys2 = ["benzene", None, "waterr", 1.0, "water"]
+        expected = np.array([[identity_distance(k1, k2) for k2 in keys2] for k1 in keys1])
+        assert np.array_equal(identity_distance_matrix(keys1, keys2), expected)
+        similarity = identity_distance_matrix(keys1, keys2, kernel=IdentityKernel.SIMILARITY)
+        assert 0 < similarity[0][2] < expected[0][2]
+        assert similarity[0][4] == 0
+
+    @pytest.mark.parametrize("n1,n2", [(1, 1), (3, 5), (5, 3), (6, 6), (2, 7)])
+    def test_find_best_match(self, n1, n2):
+        rng = np.random.default_rng(42)
+        for distance_matrix in [rng.random((n1, n2)), rng.integers(0, 3, (n1, n2)).astype(float)]:
+            indices1 = [*range(n1)]
+            indices2 = [*range(n2)]
+            while len(indices2) < len(indices1):
+                indices2.append(None)
+            match = find_best_match(indices1, indices2, distance_matrix)
+            match_ref = find_best_match_brute_force(indices1, indices2, distance_matrix)
+            matched = [i2 for i2 in match.values() if i2 is not None]
+            assert len(matched) == len(set(matched)) == min(n1, n2)
+            assert sum(distance_matrix[i1][i2] for i1, i2 in match.items() if i2 is not None) == pytest.approx(
+                sum(distance_matrix[i1][i2] for i1, i2 in match_ref.items() if i2 is not None)
+            )
+
 
 class TestSchema:
 
@@ -99,3 +208,557 @@ class TestSchema:
             diff = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND)
             df = report_diff_list(diff, message_type=MessageType.COMPOUND)
             assert df.shape
+
+    @pytest.fixture
+    def synthetic_compound_list_pair(self):
+        compound_list1 = [
+            make_compound("water", "O", 1.0, "SOLVENT"),
+            make_compound("benzene", "c1ccccc1", 2.0, "REACTANT"),
+            make_compound("sodium hydroxide", "[Na+].[OH-]", 0.5, "REAGENT"),
+        ]
+        compound_list2 = [
+            make_compound("sodium hydroxide", "[Na+].[OH-]", 0.7, "REAGENT"),
+            make_compound("water", "O", 1.0),
+        ]
+        return compound_list1, compound_list2
+
+    def test_diff_compound_list_reuses_deepdiff(self, synthetic_compound_list_pair):
+        cl1, cl2 = synthetic_compound_list_pair
+        diff = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND)
+        assert diff.index_match == {0: 1, 1: None, 2: 0}
+        assert diff.n_changed == 2
+        for i, j in diff.index_match.items():
+            if j is None:
+                assert diff.pair_comparisons[i] is None
+                continue
+            pair_comparison = MDictDiff.from_md_pair(diff.md1_list[i], diff.md2_list[j])
+            assert pair_comparison.deep_distance == diff.pair_comparisons[i].deep_distance
+            assert pair_comparison.delta_paths == diff.pair_comparisons[i].delta_paths
+        df = report_diff_list(diff, message_type=MessageType.COMPOUND)
+        assert set(df['pair_index']) == {0, 2}
+
+    def test_diff_compound_list_cache(self, synthetic_compound_list_pair, tmp_path):
+        cl1, cl2 = synthetic_compound_list_pair
+        diff = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND)
+        cache = DiffCache(store_diffs=True)
+        for _ in range(2):
+            diff_cached = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND, cache=cache)
+            assert diff_cached.index_match == diff.index_match
+            assert [pc.delta_paths if pc else None for pc in diff_cached.pair_comparisons] == \
+                   [pc.delta_paths if pc else None for pc in diff.pair_comparisons]
+        assert cache.stats["distance_hits"] == len(cl1) * len(cl2)
+        assert cache.stats["diff_hits"] == 2
+
+        cache.save(tmp_path / "cache.pkl")
+        cache_loaded = DiffCache.load(tmp_path / "cache.pkl")
+        assert len(cache_loaded) == len(cache)
+        MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND, cache=cache_loaded)
+        assert cache_loaded.stats["misses"] == 0
+
+        small_cache = DiffCache(maxsize=2)
+        MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND, cache=small_cache)
+        assert len(small_cache) == 2
+
+    def test_native_cache_reordered_workups(self):
+        wash = {"type": "WASH"}
+        dry = {"type": "DRY_WITH_MATERIAL"}
+        md_a = MDict.from_dict({"workups": [wash, dry]}, MessageType.REACTION)
+        md_b = MDict.from_dict({"workups": [dry, wash]}, MessageType.REACTION)
+        md_c = MDict.from_dict({"workups": [wash, dry]}, MessageType.REACTION)
+        cache = DiffCache()
+        dm = MDictListDiff.index_match_distance_matrix(
+            [md_a], [md_b], MessageType.REACTION, cache=cache, backend=DiffBackend.NATIVE
+        )
+        assert dm[0][0] > 0
+        dm = MDictListDiff.index_match_distance_matrix(
+            [md_a], [md_c], MessageType.REACTION, cache=cache, backend=DiffBackend.NATIVE
+        )
+        assert dm[0][0] == 0
+        dm = MDictListDiff.index_match_distance_matrix(
+            [md_c], [md_b], MessageType.REACTION, cache=cache, backend=DiffBackend.NATIVE
+        )
+        assert dm[0][0] > 0 and cache.stats["distance_hits"] == 1
+
+    def test_leaf_lookup(self):
+        md = MDict.from_message(make_compound("water", "O", 1.0, "SOLVENT"), MessageType.COMPOUND)
+        leaf = md.get_leaf(("amount", "mass", "value"))
+        assert leaf.value == 1.0
+        assert md.get_leafs([["reactionRole"], ("identifiers", 0, "value")])[1].value == "water"
+        with pytest.raises(KeyError):
+            md.get_leaf(("amount", "volume"))
+        assert [leaf.path_tuple for leaf in md.leafs_under(("identifiers", 1))] == [
+            ("identifiers", 1, "type"), ("identifiers", 1, "value")
+        ]
+        assert tuple(md.leafs_under(())) == md.leafs
+        assert md.leafs_under(("nothing",)) == []
+        md.leafs = md.leafs[:1]
+        with pytest.raises(KeyError):
+            md.get_leaf(("amount", "mass", "value"))
+        assert len(md.leafs_under(())) == 1
+
+    def test_identity_key(self, synthetic_compound_list_pair, monkeypatch):
+        cl1, cl2 = synthetic_compound_list_pair
+        md = MDict.from_message(cl1[0], MessageType.COMPOUND)
+        n_parsed = []
+        parse_dict = json_format.ParseDict
+        monkeypatch.setattr(json_format, "ParseDict", lambda *args: n_parsed.append(1) or parse_dict(*args))
+        assert md.identity_key == "water"
+        assert md.compound_name == "water"
+        assert md.is_type(MessageType.COMPOUND)
+        assert len(n_parsed) == 1
+
+        monkeypatch.setitem(IDENTITY_KEY_EXTRACTORS, MessageType.COMPOUND, lambda md: md.d.get("reactionRole"))
+        md1_list = [MDict.from_message(c, MessageType.COMPOUND) for c in cl1]
+        md2_list = [MDict.from_message(c, MessageType.COMPOUND) for c in cl2]
+        assert [md.identity_key for md in md1_list] == ["SOLVENT", "REACTANT", "REAGENT"]
+        distance_matrix = MDictListDiff.index_match_distance_matrix(md1_list, md2_list, MessageType.COMPOUND)
+        assert distance_matrix[0][1] > 100
+
+    def test_workup_alignment(self):
+        workups1 = ["ADDITION", "WASH", "DRY_WITH_MATERIAL", "CONCENTRATION"]
+        workups2 = ["WASH", "ADDITION", "DRY_WITH_MATERIAL", "FILTRATION", "CONCENTRATION"]
+        r1 = make_reaction([make_compound("water", "O")], workups1)
+        r2 = make_reaction([make_compound("water", "O")], workups2)
+        diff = MDictListDiff.from_message_list_pair(r1.workups, r2.workups, MessageType.REACTION_WORKUP)
+        assert diff.index_match == {0: 1, 1: 0, 2: 2, 3: 4}
+        diff = MDictListDiff.from_message_list_pair(
+            r1.workups, r2.workups, MessageType.REACTION_WORKUP, matching=MatchingStrategy.ALIGNMENT
+        )
+        matched = [j for j in diff.index_match.values() if j is not None]
+        assert matched == sorted(matched)
+        assert diff.index_match[2] == 2 and diff.index_match[3] == 4
+        assert [pc is None for pc in diff.pair_comparisons] == [j is None for j in diff.index_match.values()]
+
+        distance_matrix = np.array([[0.0, 1.0, 9.0], [1.0, 0.0, 9.0]])
+        assert find_alignment_match([0, 1], [0, 1, 2], distance_matrix) == {0: 0, 1: 1}
+        assert find_alignment_match([0], [0, 1], np.array([[5.0, 0.0]]), gap_cost=1) == {0: 1}
+        assert find_alignment_match([0], [0], np.array([[3.0]]), gap_cost=1) == {0: None}
+
+    def test_prefilter(self):
+        random.seed(42)
+        names = [f"compound {i}" for i in range(12)]
+        cl1 = [make_compound(n, "C" * random.randint(1, 4), float(random.randint(1, 5))) for n in names]
+        cl2 = [
+            make_compound(names[i] + "x" * (i % 4 == 0), "C" * random.randint(1, 4), float(random.randint(1, 5)))
+            for i in random.sample(range(12), 10)
+        ]
+        md1_list = [MDict.from_message(c, MessageType.COMPOUND) for c in cl1]
+        md2_list = [MDict.from_message(c, MessageType.COMPOUND) for c in cl2]
+        pair_cache = dict()
+        distance_matrix = MDictListDiff.index_match_distance_matrix(
+            md1_list, md2_list, MessageType.COMPOUND, pair_cache=pair_cache, top_k=2
+        )
+        assert len(pair_cache) < len(md1_list) * len(md2_list)
+        assert distance_matrix.shape == (12, 10)
+        diff = MDictListDiff.from_md_list_pair(md1_list, md2_list)
+        diff_prefiltered = MDictListDiff.from_md_list_pair(md1_list, md2_list, top_k=2)
+        assert diff_prefiltered.index_match == diff.index_match
+
+    def test_subtree_pruning(self, synthetic_compound_list_pair, monkeypatch):
+        cl1, _ = synthetic_compound_list_pair
+        md1 = MDict.from_message(cl1[1], MessageType.COMPOUND)
+        c2 = reaction_pb2.Compound()
+        c2.CopyFrom(cl1[1])
+        c2.amount.mass.value = 3.0
+        c2.identifiers.add(type="CAS_NUMBER", value="71-43-2")
+        md2 = MDict.from_message(c2, MessageType.COMPOUND)
+        t1, t2 = MDictDiff.engine_inputs(md1, md2)
+        assert "reactionRole" not in t1 and "reactionRole" not in t2
+        assert t1["amount"] == {"mass": {"value": 2.0}}
+
+        expected = parse_deepdiff(MDictDiff.deepdiff(md1, md2))
+        diff = MDictDiff.from_md_pair(md1, md2)
+        assert diff.deep_distance == expected.deep_distance
+        assert diff.delta_leaf_paths[DeltaType.ALTERATION] == set(expected.leaf_paths_altered_1)
+        assert diff.delta_leaf_paths[DeltaType.ADDITION] == set(expected.leaf_paths_added)
+
+        md_same = MDict.from_message(cl1[1], MessageType.COMPOUND)
+        monkeypatch.setattr(MDictDiff, "deepdiff", None)
+        diff = MDictDiff.from_md_pair(md1, md_same)
+        assert diff.deep_distance == 0 and not diff.delta_leaf_paths[DeltaType.ALTERATION]
+
+    def test_leaf_table(self):
+        md1 = MDict.from_message(make_compound("water", "O", 1.0, "SOLVENT"), MessageType.COMPOUND)
+        md2 = MDict.from_message(make_compound("water", "O", 2.0, "SOLVENT"), MessageType.COMPOUND)
+        assert md1.table.paths[0] is md2.table.paths[0]
+        assert md1.n_leafs == len(md1.leafs)
+        md_validated = MDict.model_validate(md1.model_dump())
+        assert md_validated.flat == md1.flat
+        assert MDict(d=md1.d, type=MessageType.COMPOUND).leafs == md1.leafs
+
+        diff = MDictDiff.from_md_pair(md1, md2)
+        assert diff._delta_leafs is None
+        assert diff.delta_leafs[DeltaType.ALTERATION] == [md1.get_leaf(("amount", "mass", "value"))]
+        diff_validated = MDictDiff.model_validate(diff.model_dump())
+        assert diff_validated.delta_leaf_paths == diff.delta_leaf_paths
+        assert diff_validated.delta_paths == diff.delta_paths
+
+    def test_text_index(self):
+        text = "To a solution of Benzene (2.00 g) in  water was added   sodium hydroxide."
+        text_index = TextIndex(text)
+        assert text_index.explicit_mask(["Benzene", "benzene", 2.0, 2, 3.5, True, "in water"]) == [
+            True, False, True, True, False, None, False
+        ]
+        text_index = TextIndex(text, TextNormalization(case=True, whitespace=True, numeric=False))
+        assert text_index.explicit_mask(["benzene", "SODIUM hydroxide", 2.0, "in water"]) == [True, True, True, True]
+
+        compound = make_compound("benzene", "c1ccccc1", 2.0, "REACTANT")
+        md = MDict.from_message(compound, MessageType.COMPOUND, text)
+        assert md.get_leaf(("amount", "mass", "value")).is_explicit
+        assert md.get_leaf(("identifiers", 1, "value")).is_explicit is False
+        diff = MDictListDiff.from_message_list_pair([compound], [compound], MessageType.COMPOUND, text, text_index)
+        assert diff.md1_list[0].get_leaf(("identifiers", 0, "value")).is_explicit is False
+        assert diff.md2_list[0].get_leaf(("identifiers", 0, "value")).is_explicit is True
+
+    def test_report_diff(self):
+        c1 = make_compound("water", "O", 1.0, "SOLVENT")
+        c2 = make_compound("water", mass=2.0)
+        c2.identifiers.add(type="CAS_NUMBER", value="7732-18-5")
+        diff = MDictDiff.from_message_pair(c1, c2, MessageType.COMPOUND)
+        assert ("amount", "mass", "value") in diff.delta_leaf_paths[DeltaType.ALTERATION]
+        df = report_diff(diff, message_type=MessageType.COMPOUND)
+        expected = []
+        for leaf in diff.md1.leafs:
+            if leaf in diff.delta_leafs[DeltaType.REMOVAL]:
+                expected.append(("m1", leaf.path_tuple, DeltaType.REMOVAL))
+            elif leaf in diff.delta_leafs[DeltaType.ALTERATION]:
+                expected.append(("m1", leaf.path_tuple, DeltaType.ALTERATION))
+            else:
+                expected.append(("m1", leaf.path_tuple, None))
+        for leaf in diff.md2.leafs:
+            if leaf in diff.delta_leafs[DeltaType.ADDITION]:
+                expected.append(("m2", leaf.path_tuple, DeltaType.ADDITION))
+        assert list(df["from"]) == [e[0] for e in expected]
+        assert list(df["path"]) == [".".join(str(p) for p in e[1]) for e in expected]
+        assert list(df["change_type"]) == [e[2] for e in expected]
+        assert set(df["leaf_type"]) == {"identifiers", "amount", "reactionRole"}
+
+    def test_reaction_diff(self):
+        r1 = make_reaction(
+            [make_compound("water", "O", 1.0), make_compound("benzene", "c1ccccc1")], ["ADDITION", "WASH"]
+        )
+        r2 = make_reaction([make_compound("water", "O", 2.0)], ["WASH"])
+        r1.conditions.temperature.setpoint.CopyFrom(reaction_pb2.Temperature(value=25, units="CELSIUS"))
+        r1.outcomes.add().products.add().identifiers.add(type="NAME", value="product")
+        diff = ReactionDiff.from_reaction_pair(r1, r2)
+        assert diff.outcomes is None
+        assert diff.workups.index_match == {0: None, 1: 0}
+        df = report_reaction_diff(diff)
+        assert set(df['message_type']) == {
+            MessageType.COMPOUND, MessageType.REACTION_CONDITIONS, MessageType.REACTION_WORKUP
+        }
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            diff_concurrent = ReactionDiff.from_reaction_pair(r1, r2, executor=executor)
+        assert report_reaction_diff(diff_concurrent).equals(df)
+        no_parts = ReactionDiff.model_construct(inputs=None, conditions=None, workups=None, outcomes=None)
+        empty = report_reaction_diff(no_parts)
+        assert empty.empty and set(empty.columns) == set(df.columns)
+        # the batch driver reports the same comparison, workups are matched in order
+        assert diff_reaction_pair(r1, r2).equals(df)
+        workup_rows = df[df['message_type'] == MessageType.REACTION_WORKUP]
+        assert set(workup_rows['pair_index']) == set(i for i, j in diff.workups.index_match.items() if j is not None)
+
+    def test_prepared_reference(self):
+        reference = [make_compound("water", "O", 1.0), make_compound("benzene", "c1ccccc1", role="SOLVENT")]
+        candidates = {
+            "a": [make_compound("benzene", "c1ccccc1", role="SOLVENT"), make_compound("water", "O", 2.0)],
+            "b": [make_compound("water", "O", 1.0)],
+            "c": [],
+        }
+        prepared = PreparedReference.from_messages(reference, MessageType.COMPOUND, text="water 1.0 g, benzene")
+        diffs = prepared.diff_many(candidates, candidate_texts={"a": "benzene and water"})
+        assert diffs["c"] is None
+        for name in ("a", "b"):
+            expected = MDictListDiff.from_message_list_pair(
+                reference, candidates[name], MessageType.COMPOUND,
+                "water 1.0 g, benzene", "benzene and water" if name == "a" else None,
+            )
+            assert diffs[name].index_match == expected.index_match
+            assert report_diff_list(diffs[name], MessageType.COMPOUND).equals(
+                report_diff_list(expected, MessageType.COMPOUND)
+            )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            diffs_concurrent = prepared.diff_many(candidates, {"a": "benzene and water"}, executor=executor)
+        df = report_candidates(diffs, MessageType.COMPOUND)
+        assert set(df['candidate']) == {"a", "b"}
+        assert report_candidates(diffs_concurrent, MessageType.COMPOUND).equals(df)
+        # no candidate has a pair comparison
+        empty = report_candidates({"c": diffs["c"], "d": None}, MessageType.COMPOUND)
+        assert empty.empty and list(empty.columns) == list(df.columns)
+
+    def test_lazy_imports(self):
+        code = (
+            "import sys, ord_diff.report, ord_diff.reaction, ord_diff.profiling; "
+            "print(' '.join(m for m in ('pandas', 'ord_schema.message_helpers', 'loguru') if m in sys.modules))"
+        )
+        loaded = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        assert loaded.split() == []
+        from ord_diff.base import WORKUP_TYPES
+        assert "WASH" in WORKUP_TYPES
+        assert measure_import("ord_diff.base", repeat=1) > 0
+
+    def test_benchmark(self):
+        r1, r2 = reaction_pair(0, n_inputs=3)
+        assert r1 == reaction_pair(0, n_inputs=3)[0] and r1 != r2
+        assert perturb(r1, random.Random(0), 0.0) == r1
+        c1_list, c2_list = compound_list_pair(0, n_compounds=4, fraction=0.0)
+        assert sorted(c.SerializeToString() for c in c1_list) == sorted(c.SerializeToString() for c in c2_list)
+
+        results = run_benchmarks(["md_pair", "find_best_match", "text_index"], sizes=[2], repeat=1)
+        assert [(r.stage, r.size) for r in results.results] == [
+            ("md_pair", 2), ("find_best_match", 2), ("text_index", 2)
+        ]
+        assert not compare_results(results, results)
+        slower = results.model_copy(deep=True)
+        slower.results[0].seconds += 1
+        assert [r.metric for r in compare_results(slower, results)] == ["seconds"]
+
+    def test_diff_session(self):
+        random.seed(7)
+        names = ["water", "benzene", "toluene", "THF", "methanol", "ethanol"]
+
+        def random_md():
+            c = make_compound(random.choice(names), random.choice([None, "O", "CC"]), random.choice([None, 1.0, 2.0]))
+            return MDict.from_message(c, MessageType.COMPOUND)
+
+        md1_list = [random_md() for _ in range(5)]
+        md2_list = [random_md() for _ in range(4)]
+        session = DiffSession(md1_list, md2_list)
+        assert session.n_recomputed_columns == 4
+        for _ in range(10):
+            md2_list = list(md2_list)
+            if random.random() < 0.5:
+                md2_list[random.randrange(len(md2_list))] = random_md()
+            else:
+                md2_list.insert(random.randint(0, len(md2_list)), random_md())
+            random.shuffle(md2_list)
+            list_diff = session.update(md2_list)
+            assert session.n_recomputed_columns <= 1
+            expected = MDictListDiff.from_md_list_pair(md1_list, md2_list)
+            dm = MDictListDiff.index_match_distance_matrix(md1_list, md2_list, MessageType.COMPOUND)
+            assert np.allclose(session._distance_matrix, dm)
+
+            def total(index_match):
+                return sum(dm[i][j] for i, j in index_match.items() if j is not None)
+
+            assert total(list_diff.index_match) == pytest.approx(total(expected.index_match))
+            if list_diff.index_match == expected.index_match:
+                assert report_diff_list(list_diff, MessageType.COMPOUND).equals(
+                    report_diff_list(expected, MessageType.COMPOUND)
+                )
+        list_diff = session.patch({0: md1_list[0]})
+        assert session.n_recomputed_columns <= 1
+        assert list_diff.pair_comparisons[0].deep_distance == 0
+
+    def test_diff_session_text(self):
+        c2_list = [make_compound("water", "CCO")]
+        session = DiffSession.from_message_list_pair(
+            [make_compound("water")], c2_list, MessageType.COMPOUND, m2_text="water"
+        )
+        added = session.list_diff.pair_comparisons[0].delta_leafs[DeltaType.ADDITION]
+        assert [leaf.is_explicit for leaf in added] == [False, False]
+        # same content with another text, the pair diff is reused with the leafs of the new message
+        list_diff = session.update_messages(c2_list, m2_text="water and CCO")
+        assert session.n_recomputed_columns == 0
+        added = list_diff.pair_comparisons[0].delta_leafs[DeltaType.ADDITION]
+        assert [leaf.is_explicit for leaf in added] == [False, True]
+
+    def test_diff_store(self, tmp_path):
+        c1_list = [make_compound("water", "O", 1.0), make_compound("benzene", "c1ccccc1"), make_compound("THF")]
+        c2_list = [make_compound("benzene", "c1ccccc1", 2.0), make_compound("water", "CC", 1.0)]
+        list_diff = MDictListDiff.from_message_list_pair(c1_list, c2_list, MessageType.COMPOUND, m1_text="water")
+        workup_diff = MDictListDiff.from_message_list_pair(
+            [reaction_pb2.ReactionWorkup(type="WASH", details="twice")], [reaction_pb2.ReactionWorkup(type="WASH")],
+            MessageType.REACTION_WORKUP,
+        )
+        with DiffStoreWriter(tmp_path / "store") as writer:
+            assert writer.add_list_diff(list_diff, MessageType.COMPOUND, key="r1") == 0
+            assert writer.add_list_diff(workup_diff, MessageType.REACTION_WORKUP, key="r2") == 1
+
+        store = DiffStore(tmp_path / "store")
+        assert isinstance(store.records["change_type"], np.memmap)
+        assert store.keys == ["r1", "r2"] and store.n_diffs == 3
+        assert store.index_match(0) == list_diff.index_match
+        assert list(store.diffs["deep_distance"][store.list_diff_ids(0)]) == [
+            pc.deep_distance for pc in list_diff.pair_comparisons if pc is not None
+        ]
+        df = store.to_frame(store.list_diff_ids(0))
+        expected = report_diff_list(list_diff, MessageType.COMPOUND)
+        assert df[expected.columns].equals(expected)
+        assert set(df["key"]) == {"r1"}
+        assert store.to_frame(store.list_diff_ids(1))[["path", "change_type", "leaf_type"]].values.tolist() == [
+            ["type", None, None], ["details", DeltaType.REMOVAL, None]
+        ]
+        counts = store.change_counts()
+        assert counts[DeltaType.REMOVAL][store.paths.index(("details", ))] == 1
+        assert len(store.to_frame()) == store.n_records
+
+    def test_native_backend_parity(self):
+        random.seed(42)
+        compounds = [
+            make_compound(
+                random.choice(["water", "benzene", "toluene", "THF"]),
+                random.choice([None, "O", "CC"]),
+                random.choice([None, 1.0, 2.0]),
+                random.choice([None, "SOLVENT", "REACTANT"]),
+            ) for _ in range(100)
+        ]
+        for c1, c2 in zip(compounds[::2], compounds[1::2]):
+            diff = MDictDiff.from_message_pair(c1, c2, MessageType.COMPOUND)
+            diff_native = MDictDiff.from_message_pair(c1, c2, MessageType.COMPOUND, backend=DiffBackend.NATIVE)
+            assert diff.delta_leaf_paths == diff_native.delta_leaf_paths
+            assert (diff.deep_distance == 0) == (diff_native.deep_distance == 0)
+            assert 0 <= diff_native.deep_distance <= 1
+
+        cl1 = compounds[:5]
+        cl2 = compounds[5:9]
+        diff = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND)
+        diff_native = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND, backend=DiffBackend.NATIVE)
+        assert diff.n_changed == diff_native.n_changed
+
+    def test_diff_compound_list_budget(self, synthetic_compound_list_pair):
+        cl1, cl2 = synthetic_compound_list_pair
+        diff = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND, budget=DiffBudget())
+        assert not diff.is_approximate
+
+        diff = MDictListDiff.from_message_list_pair(
+            cl1, cl2, MessageType.COMPOUND, budget=DiffBudget(max_list_size=2)
+        )
+        assert diff.is_approximate
+        assert diff.index_match == {0: 1, 1: None, 2: 0}
+
+        diff = MDictListDiff.from_message_list_pair(cl1, cl2, MessageType.COMPOUND, budget=DiffBudget(max_leafs=1))
+        assert diff.is_approximate
+        assert all(pc.is_approximate for pc in diff.pair_comparisons if pc is not None)
+        assert diff.pair_comparisons[2].delta_leaf_paths[DeltaType.ALTERATION]
+        df = report_diff_list(diff, message_type=MessageType.COMPOUND)
+        assert df['is_approximate'].all()
+
+        cache = DiffCache()
+        md1, md2 = MDict.from_message(cl1[2], MessageType.COMPOUND), MDict.from_message(cl2[0], MessageType.COMPOUND)
+        pair_diff = MDictDiff.from_md_pair(md1, md2, cache=cache, budget=DiffBudget(max_diffs=1))
+        assert pair_diff.is_approximate
+        assert len(cache) == 0
+
+    def test_find_greedy_match(self):
+        distance_matrix = np.array([[0.0, 0.1], [0.1, 5.0]])
+        assert find_greedy_match([0, 1], [0, 1], distance_matrix) == {0: 0, 1: 1}
+        assert find_best_match([0, 1], [0, 1], distance_matrix) == {0: 1, 1: 0}
+        assert find_greedy_match([0, 1], [0, None], distance_matrix) == {0: 0, 1: None}
+
+    def test_native_backend_ordered_fields(self):
+        w1 = {"type": "WASH"}
+        w2 = {"type": "DRY_WITH_MATERIAL"}
+        parsed = native_diff({"workups": [w1, w2]}, {"workups": [w2, w1]})
+        assert set(parsed.leaf_paths_altered_1) == {("workups", 0, "type"), ("workups", 1, "type")}
+        parsed = native_diff({"identifiers": [w1, w2]}, {"identifiers": [w2, w1]})
+        assert parsed.deep_distance == 0
+        assert not parsed.leaf_paths_altered_1
+
+
+class TestBatch:
+
+    def test_diff_pairs(self, synthetic_pairs):
+        result = diff_pairs(synthetic_pairs, n_workers=1, chunksize=4)
+        assert [e.rid for e in result.errors] == ["rid_bad"]
+        assert list(result.report['rid'].unique()) == [f"rid_{i}" for i in range(6)]
+        assert set(result.report['message_type']) == {MessageType.COMPOUND, MessageType.REACTION_WORKUP}
+
+        result_pool = diff_pairs(synthetic_pairs, n_workers=2, chunksize=2)
+        assert result_pool.report.equals(result.report)
+        assert [e.rid for e in result_pool.errors] == ["rid_bad"]
+
+        # no pair is reported, the columns are kept so the report can still be filtered
+        result_empty = diff_pairs(synthetic_pairs[-1:], n_workers=1)
+        assert result_empty.report.empty
+        assert set(result_empty.report.columns) == set(result.report.columns)
+
+    def test_profiling(self, synthetic_pairs):
+        records = []
+        cache = DiffCache()
+        c1_list, c2_list = [make_compound("water", "O", 1.0), make_compound("THF")], [make_compound("water", "O", 2.0)]
+        with Profiler(hooks=[lambda kind, name, value: records.append((kind, name))]) as profiler:
+            assert is_profiling()
+            list_diff = MDictListDiff.from_message_list_pair(c1_list, c2_list, MessageType.COMPOUND, cache=cache)
+            report_diff_list(list_diff, MessageType.COMPOUND)
+        assert not is_profiling()
+        profile = profiler.profile
+        assert profile.stages["message_to_dict"].calls == 3
+        assert profile.stages["matching"].calls == 1
+        assert profile.stages["report"].calls == 1
+        assert profile.counters["distance_matrix.cells"] == 2
+        assert profile.counters["matching.size"] == 2
+        assert profile.hit_rate() == cache.stats["hit_rate"]
+        assert ("stage", "deepdiff") in records and ("count", "cache.distance_misses") in records
+
+        result = diff_pairs(synthetic_pairs, n_workers=2, chunksize=2, profile=True)
+        n_reported_pairs = len(result.report.groupby(['rid', 'message_type', 'pair_index']))
+        # the conditions of the synthetic reactions are empty and reported with no rows
+        n_conditions = len(synthetic_pairs) - 1
+        assert result.profile.stages["report"].calls == n_reported_pairs + n_conditions
+        assert diff_pairs(synthetic_pairs, n_workers=1).profile is None
+
+    def test_cli(self, synthetic_pairs, tmp_path):
+        pairs_file = tmp_path / "pairs.json"
+        pairs_file.write_text(json.dumps(synthetic_pairs))
+        output = tmp_path / "report.csv"
+        batch_main([str(pairs_file), "-o", str(output), "-j", "1", "--max-list-size", "1"])
+        assert pd.read_csv(output)["is_approximate"].any()
+        assert output.exists()
+        assert (tmp_path / "report.csv.errors.json").exists()
+
+    @pytest.mark.parametrize("n_workers", [1, 2])
+    def test_stream_diff_pairs(self, synthetic_pairs, tmp_path, n_workers):
+        pairs_file = tmp_path / "pairs.jsonl"
+        pairs_file.write_text("\n".join(json.dumps(p) for p in synthetic_pairs))
+        result = stream_diff_pairs(
+            iter_pairs(pairs_file), tmp_path / "out", n_workers=n_workers, chunksize=2, part_size=20
+        )
+        assert result.n_pairs == len(synthetic_pairs)
+        assert result.n_errors == 1
+        assert len(result.parts) > 1
+        streamed = pd.concat([pd.read_csv(p) for p in result.parts], ignore_index=True)
+        expected = diff_pairs(synthetic_pairs, n_workers=1).report
+        assert list(streamed['rid']) == list(expected['rid'])
+        assert list(streamed['path']) == list(expected['path'])
+        assert len((tmp_path / "out" / "errors.jsonl").read_text().splitlines()) == 1
+
+    def test_iter_dataset_pairs(self, synthetic_pairs, tmp_path):
+        datasets = [dataset_pb2.Dataset(), dataset_pb2.Dataset()]
+        for rid, r1_json, r2_json in synthetic_pairs[:-1]:
+            for dataset, r_json in zip(datasets, [r1_json, r2_json]):
+                r = json_format.Parse(r_json, reaction_pb2.Reaction())
+                r.reaction_id = rid
+                dataset.reactions.append(r)
+        datasets[1].reactions.pop(0)
+        write_message(datasets[0], str(tmp_path / "d1.pb"))
+        write_message(datasets[1], str(tmp_path / "d2.pb"))
+        pairs = list(iter_dataset_pairs(tmp_path / "d1.pb", tmp_path / "d2.pb"))
+        assert [rid for rid, _, _ in pairs] == [rid for rid, _, _ in synthetic_pairs[1:-1]]
+        batch_main([str(tmp_path / "d1.pb"), str(tmp_path / "d2.pb"), "--output-dir", str(tmp_path / "out"), "-j", "1"])
+        assert (tmp_path / "out" / "part-00000.csv").exists()
+
+    def test_stream_diff_pairs_resume(self, synthetic_pairs, tmp_path):
+        output_dir = tmp_path / "out"
+        first = stream_diff_pairs(synthetic_pairs[:3], output_dir, n_workers=1, chunksize=1, part_size=1)
+        assert first.n_pairs == 3 and first.n_skipped == 0
+        # an orphan part of an interrupted run, not in the manifest
+        (output_dir / "part-00003.csv").write_text("garbage")
+        # and its manifest entry cut while being written
+        with open(output_dir / "manifest.jsonl", "a") as f:
+            f.write('{"part": "part-00003.csv", "rids": ["rid_')
+
+        second = stream_diff_pairs(synthetic_pairs, output_dir, n_workers=1, chunksize=1, part_size=1)
+        assert second.n_skipped == 3
+        assert second.n_pairs == len(synthetic_pairs) - 3
+        assert second.n_errors == 1
+
+        third = stream_diff_pairs(synthetic_pairs, output_dir, n_workers=1)
+        assert third.n_skipped == len(synthetic_pairs) - 1
+        assert third.n_pairs == 1 and third.n_errors == 1
+
+        streamed = pd.concat([pd.read_csv(p) for p in third.parts], ignore_index=True)
+        expected = diff_pairs(synthetic_pairs, n_workers=1).report
+        assert list(streamed['rid']) == list(expected['rid'])
+        manifest_lines = (output_dir / "manifest.jsonl").read_text().splitlines()
+        assert [json.loads(line)["part"] for line in manifest_lines] == [os.path.basename(p) for p in third.parts]